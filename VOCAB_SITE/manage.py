@@ -3,6 +3,9 @@ import os
 import sys
 
 if __name__ == "__main__":
+    # The test overrides live in their own module, see vocab_site/test_settings.py
+    if sys.argv[1:2] == ['test']:
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "vocab_site.test_settings")
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "vocab_site.settings")
 
     from django.core.management import execute_from_command_line
@@ -2,4 +2,6 @@ from __future__ import absolute_import
 
 # This will make sure the app is always imported when
 # Django starts so that shared_task will use this app.
-from .celery import app as celery_app
\ No newline at end of file
+from .celery import app as celery_app
+
+default_app_config = 'vocab.apps.VocabConfig'
@@ -0,0 +1,57 @@
+import base64
+import hashlib
+
+from django.http import JsonResponse
+from django.utils.http import urlencode
+
+from .cache import registry_version
+from .models import RegisteredIRI, iri_address
+
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+
+def accepted_iris():
+    return RegisteredIRI.objects.filter(accepted=True, reviewed=True)
+
+def iri_json(vocabulary, term_type, term):
+    return {"vocabulary": vocabulary, "term_type": term_type, "term": term,
+        "iri": iri_address(vocabulary, term_type, term)}
+
+def encode_cursor(value):
+    return base64.urlsafe_b64encode(value.encode('utf-8'))
+
+def decode_cursor(cursor):
+    try:
+        return base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    except (TypeError, ValueError):
+        return ''
+
+def registry_etag(request, *args, **kwargs):
+    """ETag for the condition() decorator on the API views.
+
+    Every API response is a function of the accepted IRIs and the query, so
+    the registry version plus the full path is a strong validator. The
+    version is read from the RegistryVersion row, one primary key lookup,
+    so every worker gives the same ETag for the same data, including right
+    after a change made in another worker or by manage.py importvocab.
+    The version is kept on the request so the view can answer from the
+    same one.
+    """
+    request.registry_version = registry_version()
+    return "%s-%s" % (request.registry_version, hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest())
+
+def page_params(request):
+    """Return the decoded cursor and page size from the query string."""
+    try:
+        limit = min(int(request.GET.get('limit', API_PAGE_SIZE)), API_MAX_PAGE_SIZE)
+    except ValueError:
+        limit = API_PAGE_SIZE
+    return decode_cursor(request.GET.get('cursor', '')), max(limit, 1)
+
+def paginated_response(request, key, rows, cursor_value, limit):
+    """rows holds up to limit + 1 items; the extra one means there is a next page."""
+    data = {key: rows[:limit], "next": None}
+    if len(rows) > limit:
+        data["next"] = "%s?%s" % (request.path, urlencode({'cursor': encode_cursor(cursor_value(rows[limit - 1])),
+            'limit': limit}))
+    return JsonResponse(data)
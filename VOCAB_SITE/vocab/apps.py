@@ -5,3 +5,11 @@ from django.apps import AppConfig
 
 class VocabConfig(AppConfig):
     name = 'vocab'
+
+    def ready(self):
+        from .audit import connect_audit_flush
+        from .cache import check_shared_cache
+        from .db import connect_connection_signals
+        check_shared_cache()
+        connect_connection_signals()
+        connect_audit_flush()
@@ -0,0 +1,172 @@
+"""Precompiled redirect artifact shared by every process on a node.
+
+compile_redirect_artifact writes the published routes to REDIRECT_ARTIFACT_FILE
+as one binary file:
+
+    header   magic, registry version, route count        (HEADER)
+    records  key, json-ld target, html target offsets    (RECORD, sorted by key)
+    strings  length prefixed utf-8 strings, each stored once
+
+Keys are return_address() without the IRI_DOMAIN prefix. Processes mmap the
+file read-only, so the kernel keeps a single copy of the pages however many
+workers there are, and a lookup is a binary search over the records. The
+compiler replaces the file with a rename; readers notice the new inode and
+map it on their next check, without a restart.
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .cache import registry_version
+from .htaccess import write_atomic
+
+logger = logging.getLogger(__name__)
+
+REDIRECT_ARTIFACT_PENDING_KEY = 'vocab:artifact:pending'
+
+MAGIC = b'VOCABRA1'
+HEADER = struct.Struct('<8sQI')
+RECORD = struct.Struct('<III')
+LENGTH = struct.Struct('<H')
+
+def route_key(vocabulary, term_type='', term=''):
+    from .models import iri_path
+    return iri_path(vocabulary, term_type, term).encode('utf-8')
+
+def compile_artifact(routes, version):
+    """Serialize {(vocabulary, term_type, term): (json-ld target, html target)}."""
+    strings = bytearray()
+    offsets = {}
+
+    def intern(value):
+        if not isinstance(value, bytes):
+            value = value.encode('utf-8')
+        if value not in offsets:
+            offsets[value] = len(strings)
+            strings.extend(LENGTH.pack(len(value)))
+            strings.extend(value)
+        return offsets[value]
+
+    records = sorted((route_key(*triple), targets) for triple, targets in routes.items())
+    parts = [HEADER.pack(MAGIC, version, len(records))]
+    for key, (json_redirect, html_redirect) in records:
+        parts.append(RECORD.pack(intern(key), intern(json_redirect), intern(html_redirect)))
+    parts.append(bytes(strings))
+    return b''.join(parts)
+
+def publish_redirect_artifact(path=None):
+    """Compile the accepted IRIs into REDIRECT_ARTIFACT_FILE. Returns the route count."""
+    from .models import RegisteredIRI
+    from .resolver import route_targets
+    # Read the version first, a change landing during the query just means
+    # the next compile is not skipped as up to date
+    version = registry_version()
+    routes = {}
+    targets = {}
+    for vocabulary, term_type, term in RegisteredIRI.objects.filter(accepted=True, reviewed=True) \
+            .values_list('vocabulary', 'term_type', 'term').iterator():
+        routes[(vocabulary, term_type, term)] = route_targets(vocabulary, term_type, term, targets)
+    write_atomic(path or settings.REDIRECT_ARTIFACT_FILE, compile_artifact(routes, version))
+    return len(routes)
+
+def schedule_artifact_compile():
+    """Queue a debounced compile once the current transaction commits."""
+    if not getattr(settings, 'REDIRECT_ARTIFACT_FILE', None):
+        return
+    from .tasks import compile_redirect_artifact
+    def schedule():
+        delay = getattr(settings, 'REDIRECT_ARTIFACT_DELAY', 5)
+        if cache.add(REDIRECT_ARTIFACT_PENDING_KEY, True, delay * 2 + 60):
+            compile_redirect_artifact.apply_async(countdown=delay)
+    transaction.on_commit(schedule)
+
+class RedirectArtifact(object):
+    """Read-only view of one compiled artifact file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as artifact_file:
+            stat = os.fstat(artifact_file.fileno())
+            # The mapping stays valid after the file is closed
+            self._map = mmap.mmap(artifact_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_mtime, stat.st_size)
+        magic, self.version, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a redirect artifact" % path)
+        self._strings = HEADER.size + self.count * RECORD.size
+
+    def _string(self, offset):
+        start = self._strings + offset + LENGTH.size
+        return self._map[start:start + LENGTH.unpack_from(self._map, start - LENGTH.size)[0]]
+
+    def lookup(self, vocabulary, term_type='', term=''):
+        """Return (json-ld target, html target) or None for unknown triples."""
+        key = route_key(vocabulary, term_type or '', term or '')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            key_offset, json_offset, html_offset = RECORD.unpack_from(self._map, HEADER.size + middle * RECORD.size)
+            candidate = self._string(key_offset)
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return self._string(json_offset).decode('utf-8'), self._string(html_offset).decode('utf-8')
+        return None
+
+    def __len__(self):
+        return self.count
+
+class SharedRedirectArtifact(object):
+    """The process's current RedirectArtifact, remapped when the file is replaced.
+
+    The file is stat()ed at most every RESOLVER_REFRESH_INTERVAL seconds. The
+    old mapping is not closed on a swap, lookups still running on it finish
+    and it is unmapped once nothing references it.
+    """
+
+    def __init__(self, path=None, refresh_interval=None):
+        self.path = path
+        self.refresh_interval = refresh_interval if refresh_interval is not None else \
+            getattr(settings, 'RESOLVER_REFRESH_INTERVAL', 5)
+        self._artifact = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def current(self):
+        """The mapped artifact, or None if none has been compiled."""
+        path = self.path or getattr(settings, 'REDIRECT_ARTIFACT_FILE', None)
+        now = time.time()
+        if not path or now - self._checked < self.refresh_interval:
+            return self._artifact
+        with self._lock:
+            if now - self._checked >= self.refresh_interval:
+                self._checked = now
+                self._swap(path)
+        return self._artifact
+
+    def _swap(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._artifact = None
+            return
+        if self._artifact is not None and self._artifact.identity == (stat.st_ino, stat.st_mtime, stat.st_size):
+            return
+        try:
+            self._artifact = RedirectArtifact(path)
+        except (IOError, OSError, ValueError, struct.error):
+            # Keep serving the previous version rather than nothing
+            logger.exception("Could not map redirect artifact %s" % path)
+
+    def invalidate(self):
+        self._checked = 0
+
+redirect_artifact = SharedRedirectArtifact()
@@ -0,0 +1,201 @@
+"""Buffered, append-only audit log (AuditEvent) and the operator queries on it.
+
+record_events only appends to an in-process buffer, once the current
+transaction commits. A daemon thread inserts the buffer with bulk_create
+every AUDIT_FLUSH_INTERVAL seconds, or as soon as it holds AUDIT_BATCH_SIZE
+events, so requests and tasks never wait on the audit insert. Whatever is
+still buffered is flushed when the process or celery worker child exits; a
+crash loses at most one interval. With AUDIT_ASYNC = False events are
+inserted on commit instead, as manage.py test does.
+
+Events are only ever appended, close to created order, so the created index
+works like a time partition: the operator view reads a recent range of it and
+prune_audit_events drops whole ranges past AUDIT_RETENTION_DAYS.
+"""
+from __future__ import absolute_import
+
+import atexit
+import logging
+import os
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Avg, Count, Max
+from django.utils import timezone
+
+from .db import prepare_connections, release_connections
+
+logger = logging.getLogger(__name__)
+
+AUDIT_PAGE_SIZE = 100
+# The widest auditLog range, timedelta overflows long before days does
+AUDIT_MAX_DAYS = 10 * 365
+DECISION_EVENTS = ('accepted', 'rejected')
+
+class AuditBuffer(object):
+    def __init__(self):
+        self._events = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+    def add(self, events):
+        if not getattr(settings, 'AUDIT_ASYNC', True):
+            self._insert(events)
+            return
+        with self._lock:
+            self._events.extend(events)
+            pending = len(self._events)
+            # Threads don't survive a fork, so each prefork child starts its own
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='vocab-audit-flush')
+                self._thread.daemon = True
+                self._thread.start()
+        if pending >= getattr(settings, 'AUDIT_BATCH_SIZE', 500):
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(getattr(settings, 'AUDIT_FLUSH_INTERVAL', 2))
+            # The exit flush takes over, and the interpreter is tearing down
+            # the modules this loop uses
+            if self._stopping:
+                return
+            self._wake.clear()
+            prepare_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Audit events could not be written")
+            finally:
+                release_connections()
+
+    def _insert(self, events):
+        from .models import AuditEvent
+        batch_size = getattr(settings, 'AUDIT_BATCH_SIZE', 500)
+        for start in range(0, len(events), batch_size):
+            AuditEvent.objects.bulk_create(events[start:start + batch_size])
+
+    def flush(self):
+        """Insert everything buffered. Returns the number of events written."""
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+        try:
+            self._insert(events)
+        except Exception:
+            # Put them back for the next attempt, within AUDIT_BUFFER_LIMIT
+            with self._lock:
+                self._events[:0] = events
+                dropped = len(self._events) - getattr(settings, 'AUDIT_BUFFER_LIMIT', 100000)
+                if dropped > 0:
+                    logger.error("Dropped the %d oldest audit events, the buffer is full" % dropped)
+                    del self._events[:dropped]
+            raise
+        return len(events)
+
+    def stop(self):
+        """Stop the flush thread, before the exit flush."""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(1)
+
+    def __len__(self):
+        return len(self._events)
+
+audit_buffer = AuditBuffer()
+
+def _flush_on_exit(**kwargs):
+    audit_buffer.stop()
+    try:
+        audit_buffer.flush()
+    except Exception:
+        logger.exception("Audit events could not be written at exit")
+
+def connect_audit_flush():
+    from celery.signals import worker_process_shutdown
+    atexit.register(_flush_on_exit)
+    # Celery's prefork children leave with os._exit, skipping atexit
+    worker_process_shutdown.connect(_flush_on_exit, weak=False)
+
+def record_events(events):
+    """Queue unsaved AuditEvents for the audit log once the transaction commits."""
+    if events:
+        transaction.on_commit(lambda: audit_buffer.add(events))
+
+def record_event(event, **fields):
+    from .models import AuditEvent
+    record_events([AuditEvent(event=event, **fields)])
+
+def iri_events(event, iris, actor='', decided=False, detail=''):
+    """One AuditEvent per RegisteredIRI; decided adds the time since registration."""
+    from .models import AuditEvent
+    now = timezone.now()
+    return [AuditEvent(event=event, created=now, actor=actor, vocabulary=iri.vocabulary, iri=iri.return_address(),
+        decision_seconds=(now - iri.created).total_seconds() if decided and iri.created else None, detail=detail)
+        for iri in iris]
+
+def recent_events(since, event=None, vocabulary=None, actor=None, before=None, page_size=AUDIT_PAGE_SIZE):
+    """One page of events since, newest first, and whether there is another.
+
+    Keyset pagination on id, like pending_iris, so old pages cost the same
+    as the first one.
+    """
+    from .models import AuditEvent
+    events = AuditEvent.objects.filter(created__gte=since).order_by('-id')
+    if event:
+        events = events.filter(event=event)
+    if vocabulary:
+        events = events.filter(vocabulary=vocabulary)
+    if actor:
+        events = events.filter(actor=actor)
+    if before:
+        events = events.filter(id__lt=before)
+    events = list(events[:page_size + 1])
+    return events[:page_size], len(events) > page_size
+
+def review_throughput(since):
+    """[(day, {event: count})] for registrations and decisions since, oldest first."""
+    from .models import AuditEvent
+    day = connection.ops.date_trunc_sql('day', connection.ops.quote_name('created'))
+    rows = AuditEvent.objects.filter(created__gte=since, event__in=('registered',) + DECISION_EVENTS) \
+        .extra(select={'day': day}).values('day', 'event').annotate(count=Count('id')).order_by('day')
+    days = []
+    for row in rows:
+        if not days or days[-1][0] != row['day']:
+            days.append((row['day'], {}))
+        days[-1][1][row['event']] = row['count']
+    return days
+
+def decision_times(since):
+    """Count, mean, median, 90th percentile and max seconds from registration to review."""
+    from .models import AuditEvent
+    decisions = AuditEvent.objects.filter(created__gte=since, event__in=DECISION_EVENTS,
+        decision_seconds__isnull=False)
+    stats = decisions.aggregate(count=Count('id'), mean=Avg('decision_seconds'), max=Max('decision_seconds'))
+    ordered = decisions.order_by('decision_seconds').values_list('decision_seconds', flat=True)
+    for name, q in (('median', 0.5), ('p90', 0.9)):
+        stats[name] = ordered[min(stats['count'] - 1, int(stats['count'] * q))] if stats['count'] else None
+    return stats
+
+def prune_audit_events(retention_days=None, batch_size=10000):
+    """Delete the events older than AUDIT_RETENTION_DAYS (kept forever if None)."""
+    from .models import AuditEvent
+    retention_days = retention_days or getattr(settings, 'AUDIT_RETENTION_DAYS', None)
+    if not retention_days:
+        return 0
+    old = AuditEvent.objects.filter(created__lt=timezone.now() - timedelta(days=retention_days))
+    deleted = 0
+    # In id ranges rather than one statement, to keep each transaction short
+    while True:
+        boundary = list(old.order_by('id').values_list('id', flat=True)[batch_size - 1:batch_size])
+        if not boundary:
+            return deleted + old.delete()[0]
+        deleted += old.filter(id__lte=boundary[0]).delete()[0]
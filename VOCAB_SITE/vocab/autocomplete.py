@@ -0,0 +1,248 @@
+"""In-memory autocomplete over the registered vocabularies and terms.
+
+Every registered IRI counts, pending and rejected ones included, since they
+all hold their triple. Lookups are a bisect into sorted arrays, so they
+answer without touching the database; "did you mean" suggestions are the
+existing names within a small edit distance of what was typed, to catch
+near-duplicates like "answerd" or "Answered" before they are submitted. They
+come from a deletion neighbourhood index rather than scoring every name.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+
+from .cache import bump_shared_counter, shared_counter
+from .db import read_database
+
+AUTOCOMPLETE_LIMIT = 10
+# The largest max_distance
+MAX_DISTANCE = 2
+AUTOCOMPLETE_VERSION_KEY = 'vocab:autocomplete:version'
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance between a and b, or limit + 1 if it is larger."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = range(len(b) + 1)
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+def max_distance(value):
+    # One typo in a short name is already a different word
+    return 1 if len(value) <= 4 else 2
+
+def deletions(value, depth):
+    """value and every string left by deleting up to depth of its characters."""
+    found = frontier = set([value])
+    for _ in range(depth):
+        frontier = set(part[:i] + part[i + 1:] for part in frontier for i in range(len(part)))
+        found = found | frontier
+    return found
+
+class DeletionIndex(object):
+    """Lowered names by the strings up to MAX_DISTANCE deletions leave of them.
+
+    Two names within edit distance d both shrink to a common string with at
+    most d deletions each, so the names within d of a query are among those
+    filed under the query's own deletions. A lookup scores only those few
+    candidates instead of every name. Entries are filed under the hash of
+    the deleted string, and a single name is stored as itself rather than a
+    list; a collision only adds a candidate that fails the scoring.
+    """
+
+    def __init__(self, keys=()):
+        self._index = {}
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        for deleted in deletions(key, MAX_DISTANCE):
+            slot = hash(deleted)
+            keys = self._index.get(slot)
+            if keys is None:
+                self._index[slot] = key
+            elif isinstance(keys, list):
+                if key not in keys:
+                    keys.append(key)
+            elif keys != key:
+                self._index[slot] = [keys, key]
+
+    def remove(self, key):
+        for deleted in deletions(key, MAX_DISTANCE):
+            slot = hash(deleted)
+            keys = self._index.get(slot)
+            if keys == key:
+                del self._index[slot]
+            elif isinstance(keys, list) and key in keys:
+                keys.remove(key)
+                if len(keys) == 1:
+                    self._index[slot] = keys[0]
+
+    def search(self, key, limit):
+        """(distance, key) for every indexed key within limit of key."""
+        candidates = set()
+        for deleted in deletions(key, limit):
+            keys = self._index.get(hash(deleted))
+            if isinstance(keys, list):
+                candidates.update(keys)
+            elif keys is not None:
+                candidates.add(keys)
+        scored = ((edit_distance(key, candidate, limit), candidate) for candidate in candidates)
+        return [(distance, candidate) for distance, candidate in scored if distance <= limit]
+
+class SortedIndex(object):
+    """Case-insensitive sorted array of names with prefix and fuzzy lookups.
+
+    The DeletionIndex behind similar() is built on its first use, so
+    reloading an index with many terms stays a sort.
+    """
+
+    def __init__(self, values=()):
+        self._keys = sorted(set((value.lower(), value) for value in values))
+        self._deletions = None
+
+    def _values(self, lowered):
+        i = bisect_left(self._keys, (lowered,))
+        while i < len(self._keys) and self._keys[i][0] == lowered:
+            yield self._keys[i][1]
+            i += 1
+
+    def add(self, value):
+        key = (value.lower(), value)
+        i = bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            self._keys.insert(i, key)
+            if self._deletions is not None:
+                self._deletions.add(key[0])
+
+    def remove(self, value):
+        key = (value.lower(), value)
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+            # "Answered" and "answered" share their lowered key
+            if self._deletions is not None and next(self._values(key[0]), None) is None:
+                self._deletions.remove(key[0])
+
+    def __contains__(self, value):
+        key = (value.lower(), value)
+        i = bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def __len__(self):
+        return len(self._keys)
+
+    def prefix(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        prefix = prefix.lower()
+        matches = []
+        for lowered, value in self._keys[bisect_left(self._keys, (prefix,)):]:
+            if not lowered.startswith(prefix) or len(matches) == limit:
+                break
+            matches.append(value)
+        return matches
+
+    def similar(self, value, limit=AUTOCOMPLETE_LIMIT):
+        """Names within max_distance of value, closest first, value itself excluded."""
+        if self._deletions is None:
+            self._deletions = DeletionIndex(sorted(set(key for key, _ in self._keys)))
+        lowered = value.lower()
+        scored = [(score, key, candidate) for score, key in self._deletions.search(lowered, max_distance(lowered))
+            for candidate in self._values(key) if candidate != value]
+        return [candidate for _, _, candidate in sorted(scored)[:limit]]
+
+class AutocompleteIndex(object):
+    """Vocabularies and, per (vocabulary, term_type), their terms.
+
+    Loaded with one query; the process that registers or deletes IRIs applies
+    the change in place (see update), and the other processes reload when the
+    shared AUTOCOMPLETE_VERSION_KEY counter moves, checked at most every
+    AUTOCOMPLETE_REFRESH_INTERVAL seconds.
+    """
+
+    def __init__(self, refresh_interval=None):
+        self.refresh_interval = refresh_interval if refresh_interval is not None else \
+            getattr(settings, 'AUTOCOMPLETE_REFRESH_INTERVAL', 5)
+        self._vocabularies = None
+        self._terms = None
+        self._counts = None
+        self._version = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def _add(self, vocabulary, term_type, term):
+        if not self._counts[vocabulary]:
+            self._vocabularies.add(vocabulary)
+        self._counts[vocabulary] += 1
+        if term:
+            self._terms.setdefault((vocabulary, term_type), SortedIndex()).add(term)
+
+    def _remove(self, vocabulary, term_type, term):
+        self._counts[vocabulary] -= 1
+        if self._counts[vocabulary] <= 0:
+            del self._counts[vocabulary]
+            self._vocabularies.remove(vocabulary)
+        if term and (vocabulary, term_type) in self._terms:
+            self._terms[(vocabulary, term_type)].remove(term)
+
+    def reload(self):
+        from .models import RegisteredIRI
+        with self._lock:
+            version = shared_counter(AUTOCOMPLETE_VERSION_KEY)
+            counts = Counter()
+            terms = {}
+            for vocabulary, term_type, term in RegisteredIRI.objects.using(read_database()) \
+                    .values_list('vocabulary', 'term_type', 'term').iterator():
+                counts[vocabulary] += 1
+                if term:
+                    terms.setdefault((vocabulary, term_type), []).append(term)
+            # Sort each array once rather than inserting row by row
+            self._terms = dict((key, SortedIndex(values)) for key, values in terms.items())
+            self._vocabularies = SortedIndex(counts)
+            self._counts = counts
+            self._version = version
+            self._checked = time.time()
+
+    def _refresh(self):
+        now = time.time()
+        if self._vocabularies is None:
+            self.reload()
+        elif now - self._checked >= self.refresh_interval:
+            self._checked = now
+            if shared_counter(AUTOCOMPLETE_VERSION_KEY) != self._version:
+                self.reload()
+
+    def update(self, added=(), removed=()):
+        """Apply triples this process registered or deleted, and tell the others."""
+        with self._lock:
+            if self._vocabularies is not None:
+                for triple in added:
+                    self._add(*triple)
+                for triple in removed:
+                    self._remove(*triple)
+            version = bump_shared_counter(AUTOCOMPLETE_VERSION_KEY)
+            # Nobody else changed anything since our last load, no reload needed
+            if self._version == version - 1:
+                self._version = version
+
+    def complete(self, field, value, vocabulary='', term_type=''):
+        """Prefix matches, whether value is taken, and near-duplicate suggestions.
+
+        field is 'vocabulary', or 'term' for the terms of vocabulary/term_type.
+        """
+        self._refresh()
+        if field == 'vocabulary':
+            index = self._vocabularies
+        else:
+            index = self._terms.get((vocabulary, term_type)) or SortedIndex()
+        return {"matches": index.prefix(value), "exists": value in index, "suggestions": index.similar(value)}
+
+autocomplete_index = AutocompleteIndex()
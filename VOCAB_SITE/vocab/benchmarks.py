@@ -0,0 +1,437 @@
+"""Offline benchmarks for the vocab views and tasks.
+
+Run with ``manage.py benchmark``. Everything runs against a throwaway test
+database (SQLite or a local Postgres, whichever DATABASES points at) filled
+with a synthetic registry shaped like fixtures/initial.json, and the results
+are written as a JSON report that can be diffed between releases.
+"""
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import urllib2
+from collections import OrderedDict
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from .models import RegisteredIRI, UserProfile, VocabularyCount
+from .tree import rebuild_vocabulary_tree
+
+TERM_TYPES = ['verbs', 'activityTypes', 'attachments', 'extensions']
+
+BENCHMARK_SHARED_CACHE = 'benchmark-shared'
+
+# Registered benchmarks, name -> function(context) returning a callable to time
+BENCHMARKS = OrderedDict()
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+def generate_registry(size, users=50, terms_per_vocabulary=200, accepted_ratio=0.9, seed=0):
+    """Bulk load a synthetic registry of roughly size RegisteredIRIs.
+
+    Like initial.json every vocabulary gets a root IRI; the rest are terms
+    spread over the four term types. Returns the created UserProfiles.
+    """
+    rng = random.Random(seed)
+    profiles = []
+    for n in range(users):
+        user = User.objects.create_user('bench%d' % n, 'bench%d@example.com' % n, 'password')
+        profiles.append(UserProfile.objects.create(user=user))
+
+    batch = []
+    created = 0
+    vocabulary_number = 0
+    while created < size:
+        vocabulary = 'vocab%d' % vocabulary_number
+        vocabulary_number += 1
+        profile = rng.choice(profiles)
+        triples = [(vocabulary, '', '')] + [(vocabulary, TERM_TYPES[n % len(TERM_TYPES)], 'term%d' % n)
+            for n in range(min(terms_per_vocabulary, size - created - 1))]
+        for vocab, term_type, term in triples:
+            accepted = rng.random() < accepted_ratio
+            iri = RegisteredIRI(vocabulary=vocab, term_type=term_type, term=term, userprofile=profile,
+                accepted=accepted, reviewed=accepted or rng.random() < 0.5)
+            iri.address = iri.build_address()
+            batch.append(iri)
+        created += len(triples)
+        if len(batch) >= 5000:
+            RegisteredIRI.objects.bulk_create(batch)
+            batch = []
+    RegisteredIRI.objects.bulk_create(batch)
+    rebuild_vocabulary_tree()
+    return profiles
+
+def measure(func, repeat):
+    """Time func repeat times, returning latency percentiles and query counts."""
+    timings = []
+    queries = []
+    status = None
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.time()
+            response = func()
+            timings.append((time.time() - start) * 1000)
+        queries.append(len(captured.captured_queries))
+        status = getattr(response, 'status_code', status)
+    timings.sort()
+    return OrderedDict([
+        ('repeat', repeat),
+        ('status', status),
+        ('mean_ms', round(sum(timings) / len(timings), 3)),
+        ('p50_ms', round(timings[len(timings) // 2], 3)),
+        ('p95_ms', round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3)),
+        ('max_ms', round(timings[-1], 3)),
+        ('queries', max(queries)),
+    ])
+
+class Context(object):
+    def __init__(self, size, profiles):
+        self.size = size
+        self.profiles = profiles
+        self.admin = User.objects.create_superuser('benchadmin', 'benchadmin@example.com', 'password')
+        self.client = Client()
+        self.client.force_login(self.profiles[0].user)
+        self.admin_client = Client()
+        self.admin_client.force_login(self.admin)
+        self.counter = 0
+
+    def unique(self):
+        self.counter += 1
+        return self.counter
+
+@benchmark('home')
+def bench_home(ctx):
+    return lambda: Client().get('/')
+
+@benchmark('searchResults')
+def bench_search(ctx):
+    return lambda: ctx.client.get('/searchResults', {'search_term': 'vocab1'})
+
+@benchmark('userProfile')
+def bench_profile(ctx):
+    return lambda: ctx.client.get('/userProfile')
+
+@benchmark('createIRI')
+def bench_create(ctx):
+    def create():
+        data = {'form-TOTAL_FORMS': '20', 'form-INITIAL_FORMS': '0'}
+        vocabulary = 'benchcreate%d' % ctx.unique()
+        for n in range(20):
+            data['form-%d-vocabulary' % n] = vocabulary
+            data['form-%d-term_type' % n] = 'verbs' if n else ''
+            data['form-%d-term' % n] = 'term%d' % n if n else ''
+        return ctx.client.post('/createIRI', data)
+    return create
+
+@benchmark('adminIRIs')
+def bench_admin(ctx):
+    return lambda: ctx.admin_client.get('/adminIRIs')
+
+@benchmark('adminIRIs_review')
+def bench_review(ctx):
+    def review():
+        ids = list(RegisteredIRI.objects.filter(reviewed=False).values_list('id', flat=True)[:20])
+        return ctx.admin_client.post('/adminIRIs', {'ids': ids, 'action': 'Accept'})
+    return review
+
+@benchmark('resolveIRI')
+def bench_resolve(ctx):
+    return lambda: Client().get('/xapi/vocab1/verbs/term4', HTTP_ACCEPT='application/ld+json')
+
+@benchmark('apiVocabularies')
+def bench_api(ctx):
+    return lambda: Client().get('/api/v1/vocabularies')
+
+@benchmark('update_htaccess')
+def bench_htaccess(ctx):
+    from .htaccess import publish_htaccess
+    return publish_htaccess
+
+def concurrent_htaccess_writers(writers=8, rounds=5):
+    """Publish the htaccess from several threads at once and check the result.
+
+    Every publish renames a complete file into place, so whichever writer
+    wins, the file must hold exactly one section per accepted vocabulary. The
+    vocabularies are read up front because an in-memory SQLite test database
+    isn't visible from other threads.
+    """
+    from .htaccess import accepted_vocabularies, render_rules, write_atomic
+    vocabularies = list(accepted_vocabularies())
+    errors = []
+    def write():
+        try:
+            for _ in range(rounds):
+                write_atomic(settings.HTACCESS_FILE, render_rules(vocabularies))
+        except Exception as e:
+            errors.append(repr(e))
+
+    start = time.time()
+    threads = [threading.Thread(target=write) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = (time.time() - start) * 1000
+
+    expected = len(vocabularies)
+    with open(settings.HTACCESS_FILE) as htaccess:
+        sections = htaccess.read().count(" Vocabulary\n")
+    return OrderedDict([
+        ('writers', writers),
+        ('rounds', rounds),
+        ('total_ms', round(elapsed, 3)),
+        ('errors', errors),
+        ('sections', sections),
+        ('expected_sections', expected),
+        ('consistent', not errors and sections == expected),
+    ])
+
+def ratelimit_overhead(iterations=20000, clients=1000, shared=None):
+    """Time rate_limited's check alone, per store, for allowed and limited requests.
+
+    Allowed requests spread over clients counters; limited ones all hit a
+    single counter that is already over the limit. shared is the cache timed
+    as the shared store, the default cache if None.
+    """
+    from django.core.cache import cache
+    from .ratelimit import LocalStore, RateLimiter
+    results = OrderedDict()
+    for store_name, store in (('local', LocalStore()), ('cache', shared or cache)):
+        limiter = RateLimiter(store)
+        start = time.time()
+        for n in range(iterations):
+            limiter.hit('bench', n % clients, '1000/s', 1000000)
+        allowed_us = (time.time() - start) * 1000000 / iterations
+        start = time.time()
+        for n in range(iterations):
+            limiter.hit('bench-limited', 0, '1/h', 1)
+        limited_us = (time.time() - start) * 1000000 / iterations
+        results[store_name] = OrderedDict([
+            ('allowed_us', round(allowed_us, 3)),
+            ('limited_us', round(limited_us, 3)),
+            ('stats', OrderedDict(('%s.%s' % key, value) for key, value in limiter.snapshot())),
+        ])
+    return results
+
+# Tasks pushed by task_throughput, in the order they are queued: a mail
+# backlog first, then the publication work queued behind it
+THROUGHPUT_TASKS = ['vocab.tasks.flush_outbox', 'vocab.tasks.update_htaccess', 'vocab.tasks.compact_redirects']
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return OrderedDict()
+    return OrderedDict([
+        ('p50_ms', round(values[len(values) // 2], 3)),
+        ('p95_ms', round(values[min(len(values) - 1, int(len(values) * 0.95))], 3)),
+        ('max_ms', round(values[-1], 3)),
+    ])
+
+def task_throughput(count=1000, routed=True):
+    """Push count of each vocab task through the broker and run them all.
+
+    Uses kombu's in-memory transport with the real CELERY_QUEUES and
+    CELERY_ROUTES. Every message is then taken off its queue and run here,
+    one after another, while a clock per queue adds up the run times: a
+    message's queue wait is how long one worker per queue would have been
+    busy with the messages ahead of it. routed=False sends every task to the
+    default queue instead, like the single queue setup before. Rate limits
+    and priorities are left to the real broker and workers.
+    """
+    from . import tasks  # registers the tasks
+    from .celery import app
+    eager = app.conf.CELERY_ALWAYS_EAGER
+    app.conf.CELERY_ALWAYS_EAGER = False
+    waits = dict((name, []) for name in THROUGHPUT_TASKS)
+    runs = dict((name, []) for name in THROUGHPUT_TASKS)
+    clocks = {}
+    try:
+        with app.connection('memory://') as conn:
+            queues = [queue(conn.default_channel) for queue in app.amqp.queues.values()]
+            for queue in queues:
+                queue.declare()
+            options = {} if routed else {'queue': app.conf.CELERY_DEFAULT_QUEUE,
+                'routing_key': app.conf.CELERY_DEFAULT_ROUTING_KEY}
+            start = time.time()
+            for name in THROUGHPUT_TASKS:
+                for _ in range(count):
+                    app.tasks[name].apply_async(connection=conn, **options)
+            published = time.time()
+
+            for queue in queues:
+                clock = 0.0
+                while True:
+                    message = queue.get(no_ack=True, accept=app.conf.CELERY_ACCEPT_CONTENT)
+                    if message is None:
+                        break
+                    body = message.payload
+                    started = time.time()
+                    app.tasks[body['task']].apply(body['args'], body['kwargs'], task_id=body['id'])
+                    run = (time.time() - started) * 1000
+                    waits[body['task']].append(clock)
+                    runs[body['task']].append(run)
+                    clock += run
+                clocks[queue.name] = round(clock, 3)
+    finally:
+        app.conf.CELERY_ALWAYS_EAGER = eager
+
+    result = OrderedDict([
+        ('routed', routed),
+        ('tasks', sum(len(values) for values in runs.values())),
+        ('published_per_s', round(count * len(THROUGHPUT_TASKS) / (published - start), 1)),
+        # Time for one worker per queue to clear the backlog
+        ('drain_ms', max(clocks.values())),
+        ('queue_busy_ms', clocks),
+    ])
+    for name in THROUGHPUT_TASKS:
+        result[name] = OrderedDict([('count', len(runs[name])), ('queue_wait', percentiles(waits[name])),
+            ('run', percentiles(runs[name]))])
+    return result
+
+# Read paths hit by serving_throughput, relative to the server's root
+SERVING_PATHS = ['/', '/searchResults?search_term=adl', '/xapi/adl/verbs/answered', '/api/v1/vocabularies']
+
+class NoRedirectHandler(urllib2.HTTPRedirectHandler):
+    """Don't follow the resolver's 303s, the redirect target isn't ours."""
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+def serving_throughput(base_url, paths=None, concurrency=50, duration=10.0):
+    """Load a running server with concurrency clients for duration seconds.
+
+    Each client thread requests paths round robin with its own connection
+    and no think time. Meant for comparing deployments with the same worker
+    budget, e.g. gunicorn -w 4 on vocab_site.wsgi against gunicorn -w 4 -k
+    gevent on vocab_site.gevent_wsgi, so run it from another machine or at
+    least another process than the servers.
+    """
+    paths = paths or SERVING_PATHS
+    opener = urllib2.build_opener(NoRedirectHandler)
+    lock = threading.Lock()
+    timings = []
+    errors = []
+    deadline = time.time() + duration
+
+    def client(offset):
+        n = offset
+        while time.time() < deadline:
+            path = paths[n % len(paths)]
+            n += 1
+            start = time.time()
+            try:
+                opener.open(base_url.rstrip('/') + path, timeout=30).read()
+            except urllib2.HTTPError as e:
+                if e.code >= 400:
+                    with lock:
+                        errors.append("%s %s" % (e.code, path))
+                    continue
+            except Exception as e:
+                with lock:
+                    errors.append("%s %s" % (e, path))
+                continue
+            with lock:
+                timings.append((time.time() - start) * 1000)
+
+    start = time.time()
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    timings.sort()
+    result = OrderedDict([
+        ('url', base_url),
+        ('concurrency', concurrency),
+        ('duration_s', round(elapsed, 3)),
+        ('requests', len(timings)),
+        ('errors', len(errors)),
+        ('requests_per_s', round(len(timings) / elapsed, 1)),
+    ])
+    if timings:
+        result['p50_ms'] = round(timings[len(timings) // 2], 3)
+        result['p95_ms'] = round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3)
+        result['max_ms'] = round(timings[-1], 3)
+    result['first_errors'] = errors[:5]
+    return result
+
+def benchmark_caches(prefix):
+    """CACHES for a benchmark run: a private LocMemCache per configured alias.
+
+    The pages, fragments, htaccess markers and counters the run writes never
+    reach the configured (shared, production) caches. BENCHMARK_SHARED_CACHE
+    is the configured default cache under a key prefix of its own, for
+    timing the rate limiter's shared store.
+    """
+    caches = dict((alias, {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': '%s-%s' % (prefix, alias)}) for alias in settings.CACHES)
+    caches[BENCHMARK_SHARED_CACHE] = dict(settings.CACHES['default'], KEY_PREFIX=prefix)
+    return caches
+
+def run_benchmarks(sizes, repeat=20, names=None, stdout=None, tasks=1000):
+    """Run the selected benchmarks at each registry size on a test database."""
+    from django.core.cache import caches
+    from .celery import app as celery_app
+    report = OrderedDict([
+        ('django', django.get_version()),
+        ('database', connection.vendor),
+        ('created', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+        ('repeat', repeat),
+        ('results', OrderedDict()),
+    ])
+    names = names or list(BENCHMARKS)
+    workdir = tempfile.mkdtemp(prefix='vocab-bench-')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    always_eager = celery_app.conf.CELERY_ALWAYS_EAGER
+    celery_app.conf.CELERY_ALWAYS_EAGER = True
+    try:
+        with override_settings(CACHES=benchmark_caches(os.path.basename(workdir)), HTACCESS_FILE=os.path.join(workdir, '.htaccess'),
+                HTACCESS_REWRITE_MAP_FILE=os.path.join(workdir, 'vocab_redirects.txt'),
+                REDIRECT_ARTIFACT_FILE=os.path.join(workdir, 'vocab_redirects.bin'),
+                EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                HTACCESS_REBUILD_DELAY=0, DEBUG=False, ALLOWED_HOSTS=['testserver'], RATELIMIT_ENABLED=False,
+                # No buildstatic manifest is needed to render pages
+                STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            for size in sizes:
+                if stdout:
+                    stdout.write("Generating %d IRIs..." % size)
+                RegisteredIRI.objects.all().delete()
+                VocabularyCount.objects.all().delete()
+                User.objects.all().delete()
+                ctx = Context(size, generate_registry(size))
+                results = OrderedDict()
+                for name in names:
+                    results[name] = measure(BENCHMARKS[name](ctx), repeat)
+                    if stdout:
+                        stdout.write("  %-20s p50 %8.2fms  p95 %8.2fms  %3d queries  status %s" % (name,
+                            results[name]['p50_ms'], results[name]['p95_ms'], results[name]['queries'],
+                            results[name]['status']))
+                results['htaccess_concurrent_writers'] = concurrent_htaccess_writers()
+                if tasks:
+                    if stdout:
+                        stdout.write("  pushing %d of each task through the routed and single queues..." % tasks)
+                    results['task_throughput'] = [task_throughput(tasks, routed=True),
+                        task_throughput(tasks, routed=False)]
+                report['results'][str(size)] = results
+            report['ratelimit_overhead'] = ratelimit_overhead(shared=caches[BENCHMARK_SHARED_CACHE])
+            if stdout:
+                for store, result in report['ratelimit_overhead'].items():
+                    stdout.write("  rate limit check (%s store): %.2fus allowed, %.2fus limited" % (store,
+                        result['allowed_us'], result['limited_us']))
+    finally:
+        celery_app.conf.CELERY_ALWAYS_EAGER = always_eager
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
@@ -0,0 +1,270 @@
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.cache import has_vary_header
+
+IRI_CACHE_SETTINGS = getattr(settings, 'VOCAB_IRI_CACHE', {})
+
+# Stored for triples that are not registered/accepted so that repeated misses
+# don't fall through to the database either
+NOT_ACCEPTED = ''
+
+_MISSING = object()
+
+USER_IRIS_VERSION_KEY = 'vocab:user:%s:iris'
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+def check_shared_cache():
+    """Refuse to start when the default cache isn't shared between processes.
+
+    A debounce marker set by a web process is cleared by the celery task it
+    queued, and the counters and rate limit buckets are meant to add up over
+    every process. With a per-process cache the task never clears the web
+    process's marker, so acceptances stop being published. Only allowed when
+    tasks run in the process that queues them (CELERY_ALWAYS_EAGER).
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES and not getattr(settings, 'CELERY_ALWAYS_EAGER', False):
+        raise ImproperlyConfigured("CACHES['default'] uses %s, which every process keeps to itself. "
+            "Point it at memcached or redis, shared by the web and celery processes." % backend)
+
+def shared_counter(key):
+    """Read a counter kept in the shared cache, creating it if needed."""
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock rather than 1 so a counter that was evicted
+        # never repeats a version (and an ETag) clients have already seen
+        seed = int(time.time() * 1000)
+        cache.add(key, seed, None)
+        version = cache.get(key, seed)
+    return version
+
+def bump_shared_counter(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        shared_counter(key)
+        return cache.incr(key)
+
+def registry_version():
+    """Counter bumped whenever the set of accepted IRIs changes.
+
+    Kept in the RegistryVersion row rather than the cache, so every web
+    worker, celery task and manage.py command (importvocab) reads the same
+    value and none of them keeps serving an old one. One primary key lookup.
+    """
+    from .models import RegistryVersion
+    return RegistryVersion.current()
+
+def bump_registry_version():
+    """Move the version on once the current transaction commits."""
+    from .models import RegistryVersion
+    transaction.on_commit(RegistryVersion.bump)
+
+def user_iris_version(user_id):
+    """Counter bumped whenever one of the user's IRIs is added, reviewed or deleted."""
+    return shared_counter(USER_IRIS_VERSION_KEY % user_id)
+
+def bump_user_iris_versions(user_ids):
+    """Move the users' counters on once the current transaction commits.
+
+    user_ids is only read then, so a queryset costs nothing on a rollback.
+    """
+    def bump():
+        for user_id in set(user_ids):
+            if user_id is not None:
+                bump_shared_counter(USER_IRIS_VERSION_KEY % user_id)
+    transaction.on_commit(bump)
+
+class LRUCache(object):
+    """Small thread-safe LRU with a per-entry time to live."""
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            if entry is _MISSING:
+                return _MISSING
+            value, expires = entry
+            if expires < time.time():
+                return _MISSING
+            # Re-insert so the entry becomes the most recently used
+            self._data[key] = entry
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time() + self.timeout)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class AcceptedIRICache(object):
+    """Two tier cache answering "is this triple accepted, and what is its address?"
+
+    The first tier is a per-process LRU, the second is whichever Django cache
+    VOCAB_IRI_CACHE['ALIAS'] points at (the shared default cache unless
+    configured otherwise). Keys include the registry version, so an answer is
+    only ever served for the version it was loaded at and nothing needs
+    invalidating: once the version moves on, every process misses and loads
+    the new answer. Entries for old versions age out of both tiers.
+    """
+
+    def __init__(self, alias=None, max_entries=None, timeout=None, local_timeout=None):
+        self.alias = alias or IRI_CACHE_SETTINGS.get('ALIAS', 'default')
+        self.timeout = timeout or IRI_CACHE_SETTINGS.get('TIMEOUT', 300)
+        self.local = LRUCache(max_entries or IRI_CACHE_SETTINGS.get('MAX_ENTRIES', 10000),
+            local_timeout or IRI_CACHE_SETTINGS.get('LOCAL_TIMEOUT', 30))
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def make_key(version, vocabulary, term_type='', term=''):
+        return 'vocab:iri:%s:%s/%s/%s' % (version, vocabulary, term_type, term)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def get_address(self, vocabulary, term_type='', term='', version=None):
+        """Return the IRI for an accepted triple, or None if it isn't accepted.
+
+        version is the registry version the answer has to belong to, e.g. the
+        one an ETag was built from; the current one when None.
+        """
+        if version is None:
+            version = registry_version()
+        key = self.make_key(version, vocabulary, term_type, term)
+        value = self.local.get(key)
+        if value is not _MISSING:
+            self._count('local_hits')
+            return value or None
+
+        value = self.shared.get(key)
+        if value is not None:
+            self._count('shared_hits')
+        else:
+            self._count('misses')
+            value = self._load(vocabulary, term_type, term)
+            self.shared.set(key, value, self.timeout)
+        self.local.set(key, value)
+        return value or None
+
+    def _load(self, vocabulary, term_type, term):
+        from .models import RegisteredIRI
+        try:
+            iri = RegisteredIRI.objects.get(vocabulary=vocabulary, term_type=term_type, term=term,
+                accepted=True, reviewed=True)
+        except RegisteredIRI.DoesNotExist:
+            return NOT_ACCEPTED
+        return iri.return_address()
+
+    def is_accepted(self, vocabulary, term_type='', term=''):
+        return self.get_address(vocabulary, term_type, term) is not None
+
+    def clear(self):
+        self.local.clear()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['local_entries'] = len(self.local)
+        return stats
+
+iri_cache = AcceptedIRICache()
+
+class RenderCacheStats(object):
+    """Hits and misses of the page and fragment caches, per name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = Counter()
+
+    def record(self, name, hit):
+        with self._lock:
+            self._counts[(name, 'hits' if hit else 'misses')] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return sorted(self._counts.items())
+
+render_cache_stats = RenderCacheStats()
+
+def render_cache_key(kind, name, *parts):
+    """Key for a rendered page or fragment of the current registry version."""
+    digest = hashlib.md5(u"|".join(u"%s" % part for part in parts).encode('utf-8')).hexdigest()
+    return 'vocab:%s:%s:%s:%s' % (kind, name, registry_version(), digest)
+
+def cache_anonymous_page(view):
+    """Cache the view's successful GET responses to anonymous users.
+
+    Anonymous users all see the same page for a given URL, and the pages
+    only change with the accepted IRIs, so the key is the registry version
+    plus the full path and nothing needs invalidating.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET' or request.user.is_authenticated():
+            return view(request, *args, **kwargs)
+        key = render_cache_key('page', view.__name__, request.get_full_path())
+        response = cache.get(key)
+        render_cache_stats.record('page:' + view.__name__, response is not None)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if shareable_response(request, response):
+                cache.set(key, response, getattr(settings, 'PAGE_CACHE_TIMEOUT', 600))
+        return response
+    return wrapper
+
+def shareable_response(request, response):
+    """Whether response can be served to every anonymous user.
+
+    Not if it sets or varies on a cookie, rendered a CSRF token (the CSRF
+    middleware sets the cookie after the view returns), or changed the
+    session, whose cookie the session middleware would set.
+    """
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return False
+    if has_vary_header(response, 'Cookie') or request.META.get('CSRF_COOKIE_USED'):
+        return False
+    session = getattr(request, 'session', None)
+    return session is None or not session.modified
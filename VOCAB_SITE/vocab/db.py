@@ -0,0 +1,148 @@
+"""Database connection reuse for the web and celery workers.
+
+Django keeps each thread's connection open for CONN_MAX_AGE seconds, which
+is the pool: a worker process holds one connection per database per thread
+and reuses it across requests and tasks. This module adds what Django 1.9
+leaves out: a health check before reusing a connection that has been idle,
+the same recycling for celery tasks as for requests, per-process stats, and
+routing of read-only queries to the replicas in DATABASE_REPLICAS.
+
+Under gevent (vocab_site/gevent_wsgi.py) connections aren't kept: see
+use_per_request_connections.
+"""
+from __future__ import absolute_import
+
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core import signals
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.db.backends.signals import connection_created
+
+class ConnectionStats(object):
+    """Per-process counters; web and celery processes each keep their own."""
+
+    FIELDS = ('opened', 'reused', 'recycled', 'health_checks', 'health_check_failures')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def incr(self, field):
+        with self._lock:
+            self._counts[field] += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts = dict(self._counts)
+        counts['open'] = sum(1 for conn in connections.all() if conn.connection is not None)
+        return counts
+
+connection_stats = ConnectionStats()
+
+def _connection_created(sender, connection, **kwargs):
+    connection._vocab_checked = time.time()
+    connection_stats.incr('opened')
+
+def prepare_connections(**kwargs):
+    """Before a request or task: drop obsolete connections and check idle ones.
+
+    A connection idle for more than DATABASE_HEALTH_CHECK_INTERVAL seconds
+    may have been cut by Postgres, pgbouncer or a firewall, so it is pinged
+    before use and reopened if the ping fails, instead of failing the
+    request's first query.
+    """
+    release_connections()
+    interval = getattr(settings, 'DATABASE_HEALTH_CHECK_INTERVAL', 30)
+    now = time.time()
+    for conn in connections.all():
+        if conn.connection is None:
+            continue
+        connection_stats.incr('reused')
+        if now - getattr(conn, '_vocab_checked', 0) < interval:
+            continue
+        connection_stats.incr('health_checks')
+        if not conn.is_usable():
+            connection_stats.incr('health_check_failures')
+            conn.close()
+        else:
+            conn._vocab_checked = now
+
+def release_connections(**kwargs):
+    """After a request or task: close connections past CONN_MAX_AGE or in error.
+
+    The same as django.db.close_old_connections, counting the recycling.
+    """
+    now = time.time()
+    for conn in connections.all():
+        # CONN_MAX_AGE = 0 closes after every request, which isn't recycling
+        if conn.connection is not None and conn.settings_dict['CONN_MAX_AGE'] and conn.close_at is not None \
+                and now >= conn.close_at:
+            connection_stats.incr('recycled')
+    close_old_connections()
+
+def use_per_request_connections():
+    """Close every connection at the end of its request, i.e. CONN_MAX_AGE = 0.
+
+    Django's connections belong to a thread, and under gevent each greenlet
+    counts as one, so every in-flight request opens its own connection. Kept
+    open, those connections would never be reused or health checked, only
+    pile up with the concurrency until CONN_MAX_AGE. Django's advice for
+    greenlets is to close them instead and let pgbouncer do the pooling.
+    """
+    for database in settings.DATABASES.values():
+        database['CONN_MAX_AGE'] = 0
+
+def connect_connection_signals():
+    """Replace Django's request hooks with the ones above and add them to celery tasks."""
+    from celery.signals import task_postrun, task_prerun
+
+    connection_created.connect(_connection_created, weak=False)
+    signals.request_started.disconnect(close_old_connections)
+    signals.request_finished.disconnect(close_old_connections)
+    signals.request_started.connect(prepare_connections, weak=False)
+    signals.request_finished.connect(release_connections, weak=False)
+    task_prerun.connect(prepare_connections, weak=False)
+    task_postrun.connect(release_connections, weak=False)
+
+def supports_on_conflict():
+    """True for INSERT ... ON CONFLICT (Postgres 9.5+)."""
+    conn = connections[DEFAULT_DB_ALIAS]
+    return conn.vendor == 'postgresql' and conn.pg_version >= 90500
+
+def read_database():
+    """Alias for a read-only query that tolerates replication lag.
+
+    Picks one of DATABASE_REPLICAS at random, or the primary if there are none.
+    """
+    replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+    if replicas:
+        return random.choice(replicas)
+    return DEFAULT_DB_ALIAS
+
+class PrimaryReplicaRouter(object):
+    """Keeps the replicas read-only.
+
+    Reads default to the primary, so a view sees its own writes; the lag
+    tolerant reads (search, export, resolution) opt in with
+    .using(read_database()).
+    """
+
+    def db_for_read(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
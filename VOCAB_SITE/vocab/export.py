@@ -0,0 +1,106 @@
+import csv
+import json
+import re
+import zlib
+
+
+from .db import read_database
+from .models import RegisteredIRI, iri_address
+
+EXPORT_CHUNK_SIZE = 2000
+
+SKOS = "http://www.w3.org/2004/02/skos/core#"
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+
+# What an N-Triples IRIREF may not contain
+IRIREF_EXCLUDED = re.compile(u'[\x00-\x20<>"{}|^`\\\\]')
+
+CONTENT_TYPES = {
+    'jsonld': 'application/ld+json',
+    'nt': 'application/n-triples',
+    'csv': 'text/csv',
+}
+
+def accepted_rows(chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield (vocabulary, term_type, term) for every accepted IRI.
+
+    Rows are read in id ordered keyset chunks of plain tuples, so only one
+    chunk is ever held in memory regardless of the registry size. All the
+    chunks come from the same replica.
+    """
+    iris = RegisteredIRI.objects.using(read_database())
+    last_id = 0
+    while True:
+        chunk = list(iris.filter(accepted=True, reviewed=True, id__gt=last_id).order_by('id')
+            .values_list('id', 'vocabulary', 'term_type', 'term')[:chunk_size])
+        for row in chunk:
+            yield row[1:]
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1][0]
+
+class Echo(object):
+    """File-like object csv.writer can write into; write returns the line."""
+    def write(self, value):
+        return value
+
+def export_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(["vocabulary", "term_type", "term", "iri"])
+    for vocabulary, term_type, term in rows:
+        yield writer.writerow([part.encode('utf-8') for part in (vocabulary, term_type, term,
+            iri_address(vocabulary, term_type, term))])
+
+def iriref(iri):
+    """iri with the characters IRIREF excludes percent-encoded.
+
+    Vocabularies and terms are free text, so a space, quote or > in one
+    would otherwise end the IRI early and make the whole file invalid.
+    """
+    return IRIREF_EXCLUDED.sub(lambda match: "%%%02X" % ord(match.group(0)), iri)
+
+def export_ntriples(rows):
+    for vocabulary, term_type, term in rows:
+        iri = iriref(iri_address(vocabulary, term_type, term))
+        if not term_type:
+            yield "<%s> <%s> <%sConceptScheme> .\n" % (iri, RDF_TYPE, SKOS)
+        else:
+            yield "<%s> <%s> <%sConcept> .\n<%s> <%sinScheme> <%s> .\n" % (iri, RDF_TYPE, SKOS, iri, SKOS,
+                iriref(iri_address(vocabulary)))
+
+def export_jsonld(rows):
+    yield '{"@context": {"skos": "%s"}, "@graph": [' % SKOS
+    separator = "\n"
+    for vocabulary, term_type, term in rows:
+        node = {"@id": iri_address(vocabulary, term_type, term)}
+        if not term_type:
+            node["@type"] = "skos:ConceptScheme"
+        else:
+            node["@type"] = "skos:Concept"
+            node["skos:inScheme"] = {"@id": iri_address(vocabulary)}
+        yield separator + json.dumps(node)
+        separator = ",\n"
+    yield "\n]}\n"
+
+EXPORTERS = {
+    'jsonld': export_jsonld,
+    'nt': export_ntriples,
+    'csv': export_csv,
+}
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_registry(fmt, gzip=False):
+    """Return an iterator over the encoded export in fmt."""
+    chunks = EXPORTERS[fmt](accepted_rows())
+    if gzip:
+        return gzip_stream(chunks)
+    return (chunk.encode('utf-8') if isinstance(chunk, unicode) else chunk for chunk in chunks)
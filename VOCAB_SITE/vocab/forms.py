@@ -40,6 +40,16 @@ class RegisteredIRIForm(ModelForm):
             'term': forms.TextInput(attrs={'placeholder': 'Term', 'class': 'form-control'})
         }
 
+    def __init__(self, *args, **kwargs):
+        # Bulk registration checks uniqueness for the whole batch in one query
+        # instead of one query per form
+        self.check_unique = kwargs.pop('check_unique', True)
+        super(RegisteredIRIForm, self).__init__(*args, **kwargs)
+
+    def validate_unique(self):
+        if self.check_unique:
+            super(RegisteredIRIForm, self).validate_unique()
+
     def clean(self):
         cleaned = super(RegisteredIRIForm, self).clean()
         term_type = cleaned.get("term_type", None)
@@ -55,14 +65,11 @@ class RequiredFormSet(BaseFormSet):
             form.empty_permitted = False
 
     def clean(self):
-        cleaned = super(RequiredFormSet, self).clean()
-        form = self.forms[0]
-        total = int(form.data['form-TOTAL_FORMS'])
-        tuple_list = []
-        for x in range(0, total):
-            data_tuple = (form.data['form-'+str(x)+'-vocabulary'], form.data['form-'+str(x)+'-term_type'], \
-                form.data['form-'+str(x)+'-term'])
-            if data_tuple in tuple_list:
+        super(RequiredFormSet, self).clean()
+        seen = set()
+        for form in self.forms:
+            cleaned = getattr(form, 'cleaned_data', {})
+            data_tuple = (cleaned.get('vocabulary'), cleaned.get('term_type'), cleaned.get('term'))
+            if data_tuple in seen:
                 raise forms.ValidationError("Forms cannot have the same triple values as other forms in the form set")
-            else:
-                tuple_list.append(data_tuple)
\ No newline at end of file
+            seen.add(data_tuple)
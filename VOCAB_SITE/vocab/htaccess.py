@@ -0,0 +1,150 @@
+import os
+import re
+import tempfile
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .audit import record_event
+
+HTACCESS_PENDING_KEY = 'vocab:htaccess:pending'
+# Set of the vocabularies in the last published file
+HTACCESS_PUBLISHED_KEY = 'vocab:htaccess:published'
+HTACCESS_STATS_KEY = 'vocab:htaccess:stats:%s'
+
+# queued: rebuilds queued, coalesced: requests folded into a queued rebuild,
+# already_published: requests dropped because their vocabularies were all in
+# the file already, written/unchanged: rebuilds that did or didn't change it
+HTACCESS_EVENTS = ('queued', 'coalesced', 'already_published', 'written', 'unchanged')
+
+_PLACEHOLDERS = re.compile("OURTITLEREPLACEMENT|OURVOCABREPLACEMENT|OURJSONLDREDIRECTREPLACEMENT|OURHTMLREDIRECTREPLACEMENT")
+
+def redirect_targets(vocabulary):
+    """Return the (json-ld, html) redirect targets for a vocabulary."""
+    return (settings.IRI_JSONLD_REDIRECT % {'vocabulary': vocabulary},
+        settings.IRI_HTML_REDIRECT % {'vocabulary': vocabulary})
+
+def accepted_vocabularies():
+    from .models import RegisteredIRI
+    return RegisteredIRI.objects.filter(accepted=True, reviewed=True).order_by('vocabulary') \
+        .values_list('vocabulary', flat=True).distinct()
+
+def render_section(vocabulary):
+    json_redirect, html_redirect = redirect_targets(vocabulary)
+    replacements = {
+        "OURTITLEREPLACEMENT": vocabulary,
+        "OURVOCABREPLACEMENT": re.escape(vocabulary),
+        "OURJSONLDREDIRECTREPLACEMENT": json_redirect,
+        "OURHTMLREDIRECTREPLACEMENT": html_redirect,
+    }
+    return _PLACEHOLDERS.sub(lambda match: replacements[match.group(0)], settings.HTACCESS_SECTION_TEMPLATE)
+
+def render_rules(vocabularies):
+    """One RewriteRule section per vocabulary, in a single pass."""
+    return "".join(render_section(vocabulary) for vocabulary in vocabularies)
+
+def render_rewrite_map(vocabularies):
+    """Apache txt RewriteMap with json/<vocabulary> and html/<vocabulary> keys.
+
+    Apache looks keys up in a hash table, so resolution costs the same no
+    matter how many vocabularies are registered. Run httxt2dbm over the file
+    for a dbm map.
+    """
+    lines = []
+    for vocabulary in vocabularies:
+        json_redirect, html_redirect = redirect_targets(vocabulary)
+        lines.append("json/%s %s\n" % (vocabulary, json_redirect))
+        lines.append("html/%s %s\n" % (vocabulary, html_redirect))
+    return "".join(lines)
+
+def write_atomic(file_path, content):
+    """Write content to a temp file next to file_path and rename it into place.
+
+    Readers (Apache) only ever see the old or the new file, never a partial
+    one, and concurrent writers no longer need to lock each other out.
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.vocab-htaccess-')
+    try:
+        with os.fdopen(fd, 'w') as tmp:
+            tmp.write(content.encode('utf-8') if isinstance(content, unicode) else content)
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def write_if_changed(file_path, content):
+    """write_atomic unless file_path already holds content. Returns whether it wrote."""
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    try:
+        with open(file_path, 'rb') as current:
+            if current.read() == content:
+                return False
+    except IOError:
+        pass
+    write_atomic(file_path, content)
+    return True
+
+def count_htaccess_event(event):
+    # The web and celery processes both count into the default cache, which
+    # check_shared_cache makes sure they share
+    key = HTACCESS_STATS_KEY % event
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between the add and the incr
+            cache.add(key, 1, None)
+
+def htaccess_stats():
+    counts = cache.get_many([HTACCESS_STATS_KEY % event for event in HTACCESS_EVENTS])
+    return OrderedDict((event, counts.get(HTACCESS_STATS_KEY % event, 0)) for event in HTACCESS_EVENTS)
+
+def publish_htaccess():
+    """Rebuild the whole rewrite config from the accepted RegisteredIRIs.
+
+    A file that would come out identical is left alone, so duplicate or
+    redundant rebuilds cost a query but never a write.
+    """
+    vocabularies = list(accepted_vocabularies())
+    if settings.HTACCESS_MODE == 'map':
+        written = write_if_changed(settings.HTACCESS_REWRITE_MAP_FILE, render_rewrite_map(vocabularies))
+        written = write_if_changed(settings.HTACCESS_FILE, settings.HTACCESS_REWRITE_MAP_RULES) or written
+    else:
+        written = write_if_changed(settings.HTACCESS_FILE, render_rules(vocabularies))
+    cache.set(HTACCESS_PUBLISHED_KEY, set(vocabularies), None)
+    count_htaccess_event('written' if written else 'unchanged')
+    if written:
+        record_event('htaccess_published', detail="%d vocabularies" % len(vocabularies))
+    return vocabularies
+
+def schedule_htaccess_rebuild(vocabularies=None):
+    """Queue a rebuild once the current transaction commits.
+
+    The rewrite config only depends on which vocabularies are published, so
+    nothing is queued when every one of vocabularies is in the file already.
+    Rebuilds are debounced: the first call within HTACCESS_REBUILD_DELAY
+    seconds queues a task and every later call is folded into it, so a burst
+    of acceptances produces a single rebuild.
+    """
+    from .tasks import update_htaccess
+    def schedule():
+        if vocabularies is not None:
+            published = cache.get(HTACCESS_PUBLISHED_KEY)
+            if published is not None and published.issuperset(vocabularies):
+                count_htaccess_event('already_published')
+                return
+        delay = settings.HTACCESS_REBUILD_DELAY
+        if cache.add(HTACCESS_PENDING_KEY, True, delay * 2 + 60):
+            count_htaccess_event('queued')
+            update_htaccess.apply_async(countdown=delay)
+        else:
+            count_htaccess_event('coalesced')
+    transaction.on_commit(schedule)
@@ -0,0 +1,278 @@
+"""Bulk import of whole vocabulary files into the registry.
+
+The readers stream entries out of CSV, JSON and JSON-LD files (including what
+exportvocab writes), so a large file is never parsed into one document.
+import_vocabulary validates each entry with the createIRI rules, diffs the
+triples against an in-memory set of the rows already registered for those
+vocabularies and only writes the difference, in chunked bulk statements that
+send no per-row signals. The bookkeeping the receivers would have done runs
+once per chunk, and the admins get one notice for the whole import.
+"""
+import codecs
+import csv
+import json
+import re
+from collections import Counter, OrderedDict
+from json.scanner import py_make_scanner
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import RegisteredIRI
+from .outbox import queue_admin_notice
+from .registration import BULK_BATCH_SIZE, clean_triple, register_iris, upload_entries
+from .review import review_iris
+
+IMPORT_READ_SIZE = 64 * 1024
+# Where json reports a decoding error, e.g. "Expecting , delimiter: line 1 column 5 (char 4)"
+JSON_ERROR_POSITION = re.compile(r'\(char (\d+)')
+# A string cut off by the end of the buffer ("end is out of bounds" when just its quote is there)
+JSON_CUT_OFF_ERRORS = ('Unterminated string', 'end is out of bounds')
+# Longer than any literal, number or escape that a read can cut in half
+JSON_TOKEN_SLACK = 16
+
+def read_csv(stream):
+    """Entries from a CSV file with a vocabulary,term_type,term header row.
+
+    Other columns, like the iri column exportvocab writes, are ignored.
+    """
+    for row in csv.DictReader(stream):
+        yield dict((key, (row.get(key) or '').decode('utf-8').strip()) for key in ('vocabulary', 'term_type', 'term'))
+
+class JSONReader(object):
+    """Incremental reader for the elements of one JSON array.
+
+    Only the element being decoded is held in memory, so the array can be far
+    larger than what json.load would comfortably parse at once.
+    """
+
+    def __init__(self, stream, read_size=IMPORT_READ_SIZE):
+        self.stream = codecs.getreader('utf-8')(stream)
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.py_decoder = json.JSONDecoder()
+        self.py_decoder.scan_once = py_make_scanner(self.py_decoder)
+        self.buffer = u''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        data = self.stream.read(self.read_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """The next non-whitespace character, or '' at the end of the input."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return u''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected '%s' at offset %d" % (char, self.pos))
+        self.pos += 1
+
+    def seek_key(self, key):
+        """Move to just after "key": in the top-level object.
+
+        The members before it are decoded and dropped, so the key showing up
+        inside a string or a nested object (e.g. the @context) isn't taken
+        for it.
+        """
+        self.expect(u'{')
+        while self.peek() not in (u'}', u''):
+            name = self.decode()
+            self.expect(u':')
+            if name == key:
+                return
+            self.peek()
+            self.decode()
+            if self.peek() != u',':
+                break
+            self.expect(u',')
+        raise ValueError("No %s key found" % json.dumps(key))
+
+    def _cut_off(self, error):
+        """Whether error may only mean the value continues past the buffer.
+
+        That is an unterminated string, or a failure in the last few
+        characters. Anything earlier is invalid JSON however much more is
+        read, so the caller gives up instead of reading to the end.
+        """
+        message = str(error)
+        if not message.startswith(JSON_CUT_OFF_ERRORS) and not JSON_ERROR_POSITION.search(message):
+            # The C scanner doesn't say where a nested value failed, the pure Python one does
+            try:
+                self.py_decoder.raw_decode(self.buffer, self.pos)
+            except ValueError as ve:
+                message = str(ve)
+        if message.startswith(JSON_CUT_OFF_ERRORS):
+            return True
+        match = JSON_ERROR_POSITION.search(message)
+        position = int(match.group(1)) if match else self.pos
+        return len(self.buffer) - position <= JSON_TOKEN_SLACK
+
+    def decode(self):
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError as ve:
+                if not self._cut_off(ve) or not self._fill():
+                    raise
+            else:
+                # A number at the end of the buffer may continue in the next read
+                if end == len(self.buffer) and self._fill():
+                    continue
+                self.pos = end
+                return value
+
+    def load(self):
+        """Decode the rest of the input as a single value."""
+        while self._fill():
+            pass
+        return self.decode()
+
+    def items(self):
+        """Yield the elements of the array starting at the current position."""
+        self.expect(u'[')
+        if self.peek() == u']':
+            return
+        while True:
+            self.peek()
+            yield self.decode()
+            if self.peek() == u']':
+                return
+            self.expect(u',')
+
+def read_json(stream):
+    """Entries from a JSON file in either createIRIUpload shape.
+
+    A list is streamed; the {"vocabulary", "terms"} form holds one vocabulary
+    and is loaded whole.
+    """
+    reader = JSONReader(stream)
+    if reader.peek() == u'[':
+        entries = reader.items()
+    else:
+        entries = upload_entries(reader.load())
+        if entries is None:
+            raise ValueError("Expected a JSON object or list")
+    for entry in entries:
+        yield entry if isinstance(entry, dict) else {'error': "Expected a JSON object"}
+
+def node_entry(node):
+    iri = node.get('@id', '') if isinstance(node, dict) else ''
+    if not iri.startswith(settings.IRI_DOMAIN):
+        return {'error': "%s is not an IRI under %s" % (iri or "Node without @id", settings.IRI_DOMAIN)}
+    parts = iri[len(settings.IRI_DOMAIN):].strip('/').split('/')
+    if len(parts) > 3:
+        return {'error': "%s has too many path segments" % iri}
+    return dict(zip(('vocabulary', 'term_type', 'term'), parts))
+
+def read_jsonld(stream):
+    """Entries from the @graph of a JSON-LD document, one per node @id."""
+    reader = JSONReader(stream)
+    reader.seek_key('@graph')
+    for node in reader.items():
+        yield node_entry(node)
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+    'jsonld': read_jsonld,
+}
+
+def existing_index(vocabularies, batch_size=BULK_BATCH_SIZE):
+    """{triple: (id, accepted, reviewed)} for every IRI in vocabularies."""
+    index = {}
+    vocabularies = sorted(vocabularies)
+    for start in range(0, len(vocabularies), batch_size):
+        for pk, vocabulary, term_type, term, accepted, reviewed in RegisteredIRI.objects \
+                .filter(vocabulary__in=vocabularies[start:start + batch_size]) \
+                .values_list('id', 'vocabulary', 'term_type', 'term', 'accepted', 'reviewed').iterator():
+            index[(vocabulary, term_type, term)] = (pk, accepted, reviewed)
+    return index
+
+def format_errors(errors):
+    if isinstance(errors, dict):
+        return "; ".join("%s: %s" % (field, " ".join(messages)) if field != '__all__' else " ".join(messages)
+            for field, messages in errors.items())
+    return errors
+
+def import_vocabulary(entries, profile, accept=False, skip_invalid=False, dry_run=False,
+        batch_size=BULK_BATCH_SIZE):
+    """Register the entries for profile, writing only what is not there yet.
+
+    With accept=True the new IRIs are published straight away and existing
+    pending ones are accepted; IRIs an admin already rejected are left alone.
+    Invalid entries abort the import before anything is written unless
+    skip_invalid is set. Returns a Counter of what happened and the list of
+    (entry number, error) pairs.
+    """
+    stats = Counter()
+    errors = []
+    triples = OrderedDict()
+    for number, entry in enumerate(entries, 1):
+        stats['read'] += 1
+        if 'error' in entry:
+            errors.append((number, entry['error']))
+            continue
+        triple, entry_errors = clean_triple(entry)
+        if entry_errors:
+            errors.append((number, format_errors(entry_errors)))
+        elif triple in triples:
+            stats['duplicates'] += 1
+        else:
+            triples[triple] = True
+    stats['invalid'] = len(errors)
+    if errors and not skip_invalid:
+        return stats, errors
+
+    existing = existing_index(set(vocabulary for vocabulary, _, _ in triples), batch_size)
+    new = []
+    pending = []
+    for triple in triples:
+        if triple not in existing:
+            new.append(triple)
+            continue
+        pk, accepted, reviewed = existing[triple]
+        if accept and not reviewed:
+            pending.append(pk)
+        elif accept and not accepted:
+            stats['rejected'] += 1
+        else:
+            stats['unchanged'] += 1
+    if dry_run:
+        stats['created'] = len(new)
+        stats['published'] = len(new) + len(pending) if accept else 0
+        return stats, errors
+
+    created = []
+    with transaction.atomic():
+        for start in range(0, len(new), batch_size):
+            chunk_created, conflicts = register_iris(profile, new[start:start + batch_size], accepted=accept,
+                notify=False)
+            created.extend(chunk_created)
+            stats['conflicts'] += len(conflicts)
+        if accept:
+            stats['published'] = len(created)
+            for start in range(0, len(pending), batch_size):
+                stats['published'] += len(review_iris(pending[start:start + batch_size], True, notify=False,
+                    actor=profile.user.username))
+        stats['created'] = len(created)
+        if created:
+            per_vocabulary = Counter(iri.vocabulary for iri in created)
+            queue_admin_notice("%d IRIs were imported by %s%s:\n\n%s" % (len(created), profile.user.username,
+                "" if accept else " and are waiting for you to review",
+                "\n".join("%s: %d" % item for item in sorted(per_vocabulary.items()))))
+    return stats, errors
@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vocab.benchmarks import BENCHMARKS, SERVING_PATHS, run_benchmarks, serving_throughput
+
+class Command(BaseCommand):
+    help = "Benchmark the vocab views and tasks against a synthetic registry and write a JSON report"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000',
+            help="Comma separated registry sizes to generate (e.g. 10000,100000,1000000)")
+        parser.add_argument('--repeat', type=int, default=20, help="Runs per benchmark")
+        parser.add_argument('--only', default='', help="Comma separated benchmarks to run (default: all)")
+        parser.add_argument('--tasks', type=int, default=1000,
+            help="Tasks of each type to push through the celery queues (0 to skip)")
+        parser.add_argument('-o', '--output', default=None, help="Write the JSON report to this file")
+        parser.add_argument('--serve', action='append', default=[], metavar='URL',
+            help="Instead of the synthetic benchmarks, load the running server at URL (repeatable, to compare "
+                "deployments)")
+        parser.add_argument('--concurrency', type=int, default=50, help="Concurrent clients for --serve")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds to load each --serve URL")
+        parser.add_argument('--paths', default=",".join(SERVING_PATHS), help="Comma separated paths for --serve")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError("--sizes must be a comma separated list of integers")
+        names = [name for name in options['only'].split(',') if name]
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError("Unknown benchmarks: %s (choose from %s)" % (", ".join(sorted(unknown)),
+                ", ".join(BENCHMARKS)))
+
+        if options['serve']:
+            paths = [path for path in options['paths'].split(',') if path]
+            report = {"serving": [serving_throughput(url, paths, options['concurrency'], options['duration'])
+                for url in options['serve']]}
+        else:
+            report = run_benchmarks(sizes, options['repeat'], names, self.stdout, options['tasks'])
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                out.write(output + "\n")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,23 @@
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = "Bundle, minify, fingerprint and precompress the static files into STATIC_ROOT"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', default=False,
+            help="Delete everything in STATIC_ROOT first, including the builds of older asset versions")
+
+    def handle(self, *args, **options):
+        # The work is done by STATICFILES_STORAGE (vocab.storage) as collectstatic post-processes
+        call_command('collectstatic', interactive=False, clear=options['clear'], verbosity=0)
+        storage = staticfiles_storage
+        for name, hashed_name in sorted(storage.hashed_files.items()):
+            sizes = ["%8d" % storage.size(hashed_name)]
+            for suffix in ('.gz', '.br'):
+                sizes.append("%8d" % storage.size(hashed_name + suffix) if storage.exists(hashed_name + suffix)
+                    else "%8s" % '-')
+            self.stdout.write("%s  %s" % ("".join(sizes), hashed_name))
+        self.stdout.write("%d files in %s, manifest %s" % (len(storage.hashed_files), storage.location,
+            storage.manifest_name))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from vocab.artifact import publish_redirect_artifact
+
+class Command(BaseCommand):
+    help = "Compile the accepted IRIs into the REDIRECT_ARTIFACT_FILE the resolver maps"
+
+    def handle(self, *args, **options):
+        routes = publish_redirect_artifact()
+        self.stdout.write("Compiled %d routes" % routes)
@@ -0,0 +1,22 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from vocab.export import EXPORTERS, export_registry
+
+class Command(BaseCommand):
+    help = "Stream every accepted IRI as JSON-LD, N-Triples or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='fmt', choices=sorted(EXPORTERS), default='jsonld')
+        parser.add_argument('--gzip', action='store_true', default=False, help="gzip the output")
+        parser.add_argument('-o', '--output', default=None, help="File to write to (default: stdout)")
+
+    def handle(self, *args, **options):
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout
+        try:
+            for chunk in export_registry(options['fmt'], options['gzip']):
+                out.write(chunk)
+        finally:
+            if options['output']:
+                out.close()
@@ -0,0 +1,65 @@
+import gzip
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vocab.importer import READERS, import_vocabulary
+from vocab.models import UserProfile
+
+MAX_REPORTED_ERRORS = 20
+
+class Command(BaseCommand):
+    help = "Register every IRI in a CSV, JSON or JSON-LD vocabulary file that isn't registered yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, - for stdin, .gz files are decompressed")
+        parser.add_argument('--user', default=None, help="Username the new IRIs are registered for")
+        parser.add_argument('--format', dest='fmt', choices=sorted(READERS), default=None,
+            help="File format (default: from the file extension)")
+        parser.add_argument('--accept', action='store_true', default=False,
+            help="Publish the IRIs straight away instead of queueing them for review")
+        parser.add_argument('--skip-invalid', action='store_true', default=False,
+            help="Import the valid entries even if some are invalid")
+        parser.add_argument('--dry-run', action='store_true', default=False,
+            help="Only report what would change")
+
+    def handle(self, *args, **options):
+        if not options['user']:
+            raise CommandError("Give the --user the new IRIs are registered for")
+        path = options['path']
+        name = path[:-3] if path.endswith('.gz') else path
+        fmt = options['fmt'] or os.path.splitext(name)[1].lstrip('.').lower()
+        if fmt not in READERS:
+            raise CommandError("Unknown format %r, give one of %s with --format" % (fmt, ", ".join(sorted(READERS))))
+        try:
+            profile = UserProfile.objects.select_related('user').get(user__username=options['user'])
+        except UserProfile.DoesNotExist:
+            raise CommandError("No user profile for %s" % options['user'])
+
+        if path == '-':
+            stream = sys.stdin
+        elif path.endswith('.gz'):
+            stream = gzip.open(path, 'rb')
+        else:
+            stream = open(path, 'rb')
+        try:
+            stats, errors = import_vocabulary(READERS[fmt](stream), profile, accept=options['accept'],
+                skip_invalid=options['skip_invalid'], dry_run=options['dry_run'])
+        except ValueError as ve:
+            raise CommandError("Could not read %s: %s" % (path, ve))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for number, error in errors[:MAX_REPORTED_ERRORS]:
+            self.stderr.write("Entry %d: %s" % (number, error))
+        if len(errors) > MAX_REPORTED_ERRORS:
+            self.stderr.write("... and %d more invalid entries" % (len(errors) - MAX_REPORTED_ERRORS))
+        if errors and not options['skip_invalid']:
+            raise CommandError("Nothing was imported, fix the entries above or use --skip-invalid")
+
+        self.stdout.write("%s%d entries read, %d invalid, %d duplicates, %d created, %d published, "
+            "%d already registered, %d rejected earlier, %d taken concurrently" % (
+            "Dry run: " if options['dry_run'] else "", stats['read'], stats['invalid'], stats['duplicates'],
+            stats['created'], stats['published'], stats['unchanged'], stats['rejected'], stats['conflicts']))
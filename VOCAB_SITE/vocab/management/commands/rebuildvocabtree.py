@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from vocab.tree import rebuild_vocabulary_tree
+
+class Command(BaseCommand):
+    help = "Backfill RegisteredIRI.address and recompute the VocabularyCount table"
+
+    def handle(self, *args, **options):
+        addresses, counts = rebuild_vocabulary_tree()
+        self.stdout.write("Updated %d addresses and %d vocabulary counts" % (addresses, counts))
@@ -0,0 +1,210 @@
+"""In-process performance metrics for views and celery tasks.
+
+Each process keeps a rolling window of samples per view/task and exposes
+percentiles in the Prometheus text format (see views.metrics). Numbers are
+per process, so scrape every web worker; celery workers log their slow tasks.
+"""
+from __future__ import absolute_import
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('wall_ms', 'queries', 'query_ms', 'cache_hits', 'template_ms')
+QUANTILES = (0.5, 0.9, 0.99)
+
+_local = threading.local()
+
+class RollingWindow(object):
+    """The last size samples of each field, plus all-time count and sums."""
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.sums = dict.fromkeys(FIELDS, 0.0)
+
+    def add(self, sample):
+        self.samples.append(sample)
+        self.count += 1
+        for field in FIELDS:
+            self.sums[field] += sample[field]
+
+    def quantile(self, field, q):
+        values = sorted(sample[field] for sample in self.samples)
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+class MetricsRegistry(object):
+    def __init__(self, window=None):
+        self.window = window or getattr(settings, 'METRICS_WINDOW', 1000)
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def observe(self, kind, name, sample):
+        with self._lock:
+            key = (kind, name)
+            if key not in self._windows:
+                self._windows[key] = RollingWindow(self.window)
+            self._windows[key].add(sample)
+
+    def snapshot(self):
+        with self._lock:
+            return sorted(self._windows.items())
+
+    def reset(self):
+        with self._lock:
+            self._windows = {}
+
+    def render_prometheus(self):
+        from .cache import iri_cache, render_cache_stats
+        from .db import connection_stats
+        from .htaccess import htaccess_stats
+        from .ratelimit import rate_limiter
+        lines = []
+        windows = self.snapshot()
+        for field in FIELDS:
+            metric = 'vocab_%s' % field
+            lines.append('# TYPE %s summary' % metric)
+            for (kind, name), window in windows:
+                labels = 'kind="%s",name="%s"' % (kind, name)
+                # Compute under the lock so a concurrent add can't change the deque mid-sort
+                with self._lock:
+                    values = [(q, window.quantile(field, q)) for q in QUANTILES]
+                    count, total = window.count, window.sums[field]
+                for q, value in values:
+                    lines.append('%s{%s,quantile="%s"} %s' % (metric, labels, q, round(value, 3)))
+                lines.append('%s_sum{%s} %s' % (metric, labels, round(total, 3)))
+                lines.append('%s_count{%s} %d' % (metric, labels, count))
+        lines.append('# TYPE vocab_iri_cache counter')
+        for stat, value in sorted(iri_cache.stats().items()):
+            lines.append('vocab_iri_cache{stat="%s"} %d' % (stat, value))
+        lines.append('# TYPE vocab_render_cache counter')
+        for (name, stat), value in render_cache_stats.snapshot():
+            lines.append('vocab_render_cache{name="%s",stat="%s"} %d' % (name, stat, value))
+        lines.append('# TYPE vocab_db_connections counter')
+        for stat, value in sorted(connection_stats.snapshot().items()):
+            lines.append('vocab_db_connections{stat="%s"} %d' % (stat, value))
+        lines.append('# TYPE vocab_ratelimit counter')
+        for (name, stat), value in rate_limiter.snapshot():
+            lines.append('vocab_ratelimit{name="%s",stat="%s"} %d' % (name, stat, value))
+        # Shared by every process (see cache.check_shared_cache), unlike the figures above
+        lines.append('# TYPE vocab_htaccess_rebuilds counter')
+        for event, value in htaccess_stats().items():
+            lines.append('vocab_htaccess_rebuilds{event="%s"} %d' % (event, value))
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+def _iri_cache_hits():
+    from .cache import iri_cache
+    stats = iri_cache.stats()
+    return stats['local_hits'] + stats['shared_hits']
+
+def start_measurement():
+    """Begin collecting a sample for the current thread.
+
+    Returns False if a sample is already being collected (an eager task run
+    inside a request), in which case the outer measurement includes it.
+    """
+    if hasattr(_local, 'start'):
+        return False
+    _local.start = time.time()
+    _local.queries = 0
+    _local.query_ms = 0.0
+    _local.cache_hits_start = _iri_cache_hits()
+    _local.template_ms = 0.0
+    return True
+
+def finish_measurement(kind, name, extra=None):
+    """Record the sample started by start_measurement and return it."""
+    if not hasattr(_local, 'start'):
+        return None
+    wall_ms = (time.time() - _local.start) * 1000
+    sample = {
+        'wall_ms': wall_ms,
+        'queries': _local.queries,
+        'query_ms': _local.query_ms,
+        # Process wide, so concurrent threads' hits are included
+        'cache_hits': _iri_cache_hits() - _local.cache_hits_start,
+        'template_ms': _local.template_ms,
+    }
+    del _local.start
+    metrics.observe(kind, name, sample)
+
+    if wall_ms >= getattr(settings, 'METRICS_SLOW_MS', 500):
+        line = OrderedDict([('kind', kind), ('name', name)])
+        line.update((field, round(sample[field], 3) if isinstance(sample[field], float) else sample[field])
+            for field in FIELDS)
+        line.update(extra or {})
+        logger.warning("slow %s %s" % (kind, json.dumps(line)))
+    return sample
+
+def instrument_queries():
+    """Count and time every query into the current sample.
+
+    Patches CursorWrapper, which every cursor Django hands out goes through
+    (CursorDebugWrapper included), and only keeps two running totals per
+    thread. Unlike debug cursors nothing is stored per query, so it stays
+    cheap in production and doesn't stop counting in long lived celery
+    workers. METRICS_CAPTURE_QUERIES = False turns it off.
+    """
+    from django.db.backends.utils import CursorWrapper
+    if not getattr(settings, 'METRICS_CAPTURE_QUERIES', True) or \
+            getattr(CursorWrapper.execute, '_vocab_metrics', False):
+        return
+    def timed(original):
+        def run(self, *args, **kwargs):
+            start = time.time()
+            try:
+                return original(self, *args, **kwargs)
+            finally:
+                if hasattr(_local, 'start'):
+                    _local.queries += 1
+                    _local.query_ms += (time.time() - start) * 1000
+        run._vocab_metrics = True
+        return run
+    CursorWrapper.execute = timed(CursorWrapper.execute)
+    CursorWrapper.executemany = timed(CursorWrapper.executemany)
+
+def instrument_templates():
+    """Time every Django template render into the current sample.
+
+    views render() straight away rather than returning TemplateResponses,
+    so the backend's Template.render is the one place all renders pass.
+    """
+    from django.template.backends.django import Template
+    if getattr(Template.render, '_vocab_metrics', False):
+        return
+    original = Template.render
+    def render(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            if hasattr(_local, 'template_ms'):
+                _local.template_ms += (time.time() - start) * 1000
+    render._vocab_metrics = True
+    Template.render = render
+
+def connect_task_signals():
+    """Measure every celery task the same way the middleware measures views."""
+    from celery.signals import task_postrun, task_prerun
+    instrument_queries()
+
+    def prerun(sender=None, **kwargs):
+        _local.task_measured = start_measurement()
+
+    def postrun(sender=None, **kwargs):
+        if getattr(_local, 'task_measured', False):
+            _local.task_measured = False
+            finish_measurement('task', sender.name, {'state': kwargs.get('state')})
+
+    task_prerun.connect(prerun, weak=False)
+    task_postrun.connect(postrun, weak=False)
@@ -0,0 +1,25 @@
+from .metrics import finish_measurement, instrument_queries, instrument_templates, start_measurement
+
+class PerformanceMiddleware(object):
+    """Record wall time, queries, cache hits and template time per view.
+
+    Should be first in MIDDLEWARE_CLASSES so the sample covers the rest of
+    the middleware as well as the view.
+    """
+
+    def __init__(self):
+        instrument_queries()
+        instrument_templates()
+
+    def process_request(self, request):
+        start_measurement()
+        request._metrics_view = None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view = getattr(view_func, '__name__', repr(view_func))
+
+    def process_response(self, request, response):
+        name = getattr(request, '_metrics_view', None) or 'unresolved'
+        finish_measurement('view', name, {'method': request.method, 'path': request.path,
+            'status': response.status_code})
+        return response
@@ -4,11 +4,20 @@ import json
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models, IntegrityError
-from django.db.models.signals import post_save
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
-from .tasks import notify_admins
+from .artifact import schedule_artifact_compile
+from .audit import iri_events, record_events
+from .autocomplete import autocomplete_index
+from .cache import bump_registry_version, bump_user_iris_versions
+from .db import supports_on_conflict
+from .htaccess import schedule_htaccess_rebuild
+from .resolver import routing_table
+from .outbox import queue_admin_notice
 
 TERM_TYPE_CHOICES = (
 	('', ''),
@@ -18,39 +27,282 @@ TERM_TYPE_CHOICES = (
 	('extensions', 'Extensions')
 )
 
+def iri_path(vocabulary, term_type='', term=''):
+	"""vocabulary[/term_type[/term]], an IRI without the IRI_DOMAIN prefix."""
+	return "/".join(part for part in (vocabulary, term_type, term) if part)
+
+def iri_address(vocabulary, term_type='', term=''):
+	return settings.IRI_DOMAIN + iri_path(vocabulary, term_type, term)
+
 class UserProfile(models.Model):
 	user = models.OneToOneField(User, on_delete=models.CASCADE)
 
 	def __unicode__(self):
-		return json.dumps({"user": self.user.username, "registeredIRIs": [iri.return_address() for iri in self.registerediri_set.all()]})	
+		return json.dumps({"user": self.user.username, "registeredIRIs": list(self.registerediri_set.values_list('address', flat=True))})
 
 class RegisteredIRI(models.Model):
-	vocabulary = models.CharField(max_length=50)
-	term_type = models.CharField(max_length=15, blank=True, choices=TERM_TYPE_CHOICES)
-	term = models.CharField(max_length=50, blank=True)
+	vocabulary = models.CharField(max_length=50, db_index=True)
+	term_type = models.CharField(max_length=15, blank=True, choices=TERM_TYPE_CHOICES, db_index=True)
+	term = models.CharField(max_length=50, blank=True, db_index=True)
 	accepted = models.BooleanField(default=False)
 	reviewed = models.BooleanField(default=False)
 	userprofile = models.ForeignKey(UserProfile, null=True, on_delete=models.SET_NULL)
+	# Denormalized return_address(), kept in sync by save()
+	address = models.CharField(max_length=255, blank=True, db_index=True, editable=False)
+	created = models.DateTimeField(default=timezone.now, editable=False)
+
+	def build_address(self):
+		return iri_address(self.vocabulary, self.term_type, self.term)
 
 	def return_address(self):
-		if self.term_type:
-			if self.term:
-				return settings.IRI_DOMAIN + "/".join([self.vocabulary, self.term_type, self.term])
-			return settings.IRI_DOMAIN + "/".join([self.vocabulary, self.term_type])
-		return settings.IRI_DOMAIN + self.vocabulary
+		return self.address or self.build_address()
 
 	class Meta:
 		unique_together = ("vocabulary", "term_type", "term")
+		# Review queue lookups (see review.pending_iris)
+		index_together = [("reviewed", "accepted", "id")]
 
 	def save(self, *args, **kwargs):
 		if self.term and not self.term_type:
 			raise IntegrityError("Must supply a term type if supplying a term")
+		self.address = self.build_address()
 		super(RegisteredIRI, self).save(*args, **kwargs)
 
 	def __unicode__(self):
 		return json.dumps({"address": self.return_address(), "user": self.userprofile.user.username})
 
+class VocabularyCount(models.Model):
+	"""Materialized count of the IRIs under each vocabulary and term type.
+
+	The root IRI of a vocabulary is counted under term_type ''. Rows are
+	maintained incrementally by the RegisteredIRI receivers and by the bulk
+	registration/review paths; manage.py rebuildvocabtree recomputes them.
+	"""
+	vocabulary = models.CharField(max_length=50)
+	term_type = models.CharField(max_length=15, blank=True)
+	total = models.IntegerField(default=0)
+	accepted = models.IntegerField(default=0)
+
+	class Meta:
+		unique_together = ("vocabulary", "term_type")
+
+	@classmethod
+	def adjust(cls, vocabulary, term_type, total=0, accepted=0):
+		"""Add to the counts once the surrounding transaction commits.
+
+		Deferring the write keeps the row lock out of the registering and
+		reviewing transactions, so parallel submitters to one vocabulary don't
+		queue behind each other. A crash between the commit and the update
+		loses the delta; manage.py rebuildvocabtree repairs that.
+		"""
+		if total or accepted:
+			transaction.on_commit(lambda: cls.apply(vocabulary, term_type, total, accepted))
+
+	@classmethod
+	def apply(cls, vocabulary, term_type, total=0, accepted=0):
+		if supports_on_conflict():
+			# One statement, whoever creates the row first
+			table = connection.ops.quote_name(cls._meta.db_table)
+			with connection.cursor() as cursor:
+				cursor.execute("INSERT INTO %s (vocabulary, term_type, total, accepted) VALUES (%%s, %%s, %%s, %%s) "
+					"ON CONFLICT (vocabulary, term_type) DO UPDATE SET total = %s.total + EXCLUDED.total, "
+					"accepted = %s.accepted + EXCLUDED.accepted" % (table, table, table),
+					[vocabulary, term_type, total, accepted])
+			return
+		if not cls.objects.filter(vocabulary=vocabulary, term_type=term_type) \
+			.update(total=F('total') + total, accepted=F('accepted') + accepted):
+			try:
+				with transaction.atomic():
+					cls.objects.create(vocabulary=vocabulary, term_type=term_type, total=total, accepted=accepted)
+			except IntegrityError:
+				# Someone else created the row in the meantime
+				cls.objects.filter(vocabulary=vocabulary, term_type=term_type) \
+					.update(total=F('total') + total, accepted=F('accepted') + accepted)
+
+	def __unicode__(self):
+		return json.dumps({"vocabulary": self.vocabulary, "term_type": self.term_type, "total": self.total,
+			"accepted": self.accepted})
+
+class RegistryVersion(models.Model):
+	"""Single row holding the version of the accepted IRI set (see cache.registry_version)."""
+	version = models.BigIntegerField(default=0)
+
+	@classmethod
+	def current(cls):
+		return cls.objects.filter(id=1).values_list('version', flat=True).first() or 0
+
+	@classmethod
+	def bump(cls):
+		"""Increment the version and return the new one."""
+		with transaction.atomic():
+			row, _ = cls.objects.select_for_update().get_or_create(id=1)
+			row.version += 1
+			row.save(update_fields=['version'])
+		return row.version
+
+	def __unicode__(self):
+		return json.dumps({"version": self.version})
+
+class EmailNotice(models.Model):
+	recipient = models.EmailField(max_length=254)
+	subject = models.CharField(max_length=200)
+	body = models.TextField()
+	created = models.DateTimeField(default=timezone.now)
+	sent = models.DateTimeField(null=True, blank=True)
+	attempts = models.PositiveSmallIntegerField(default=0)
+	next_attempt = models.DateTimeField(default=timezone.now)
+	last_error = models.TextField(blank=True)
+	# Set by the drain that claimed the notice (see outbox.claim_notices)
+	claim = models.CharField(max_length=32, blank=True, editable=False)
+
+	class Meta:
+		# Outbox drain lookups (see outbox.drain_outbox)
+		index_together = [("sent", "next_attempt")]
+
+	def __unicode__(self):
+		return json.dumps({"recipient": self.recipient, "subject": self.subject, "sent": self.sent is not None})
+
+class RedirectDelta(models.Model):
+	"""One change to the published redirect set (the accepted, reviewed IRIs).
+
+	version is the RegistryVersion the change was published at, see stamp()
+	and vocab/redirects.py.
+	"""
+	vocabulary = models.CharField(max_length=50)
+	term_type = models.CharField(max_length=15, blank=True)
+	term = models.CharField(max_length=50, blank=True)
+	# True when the IRI was published, False when it was withdrawn
+	published = models.BooleanField()
+	created = models.DateTimeField(default=timezone.now, db_index=True)
+	# None until stamp() runs after the recording transaction commits
+	version = models.BigIntegerField(null=True, blank=True, db_index=True)
+
+	@classmethod
+	def record(cls, triples, published):
+		cls.objects.bulk_create([cls(vocabulary=vocabulary, term_type=term_type, term=term, published=published)
+			for vocabulary, term_type, term in triples])
+		transaction.on_commit(cls.stamp)
+
+	@classmethod
+	def stamp(cls):
+		"""Give every committed, unversioned delta the next registry version.
+
+		The RegistryVersion row stays locked until the stamped deltas commit, so
+		versions are handed out in commit order: once a reader sees version N,
+		every delta at or below N is already visible to it. Ids don't have that
+		property, a later id can commit first.
+		"""
+		with transaction.atomic():
+			version = RegistryVersion.bump()
+			cls.objects.filter(version=None).update(version=version)
+
+	def __unicode__(self):
+		return json.dumps({"version": self.version, "vocabulary": self.vocabulary, "term_type": self.term_type,
+			"term": self.term, "published": self.published})
+
+class RedirectSnapshot(models.Model):
+	"""The whole published redirect set as of RedirectDelta version."""
+	version = models.PositiveIntegerField(unique=True)
+	created = models.DateTimeField(default=timezone.now)
+	# JSON list of [vocabulary, term_type, term]
+	routes = models.TextField()
+	size = models.PositiveIntegerField(default=0)
+
+	def triples(self):
+		return set(tuple(triple) for triple in json.loads(self.routes))
+
+	def __unicode__(self):
+		return json.dumps({"version": self.version, "size": self.size})
+
+AUDIT_EVENT_CHOICES = (
+	('registered', 'Registered'),
+	('accepted', 'Accepted'),
+	('rejected', 'Rejected'),
+	('deleted', 'Deleted'),
+	('htaccess_published', 'htaccess published'),
+)
+
+class AuditEvent(models.Model):
+	"""Append-only history of registrations, reviews and htaccess publications.
+
+	Written in batches by vocab/audit.py and never updated. actor and iri are
+	copies rather than foreign keys so the history outlives what it mentions;
+	actor is empty for changes made outside the site's views (e.g. the Django
+	admin).
+	"""
+	event = models.CharField(max_length=20, choices=AUDIT_EVENT_CHOICES)
+	created = models.DateTimeField(default=timezone.now, db_index=True)
+	actor = models.CharField(max_length=150, blank=True)
+	vocabulary = models.CharField(max_length=50, blank=True)
+	iri = models.CharField(max_length=255, blank=True)
+	# Seconds from registration to an accepted/rejected decision
+	decision_seconds = models.FloatField(null=True, blank=True)
+	detail = models.CharField(max_length=255, blank=True)
+
+	class Meta:
+		# Operator queries by event over a time range (see audit.review_throughput)
+		index_together = [("event", "created")]
+
+	def __unicode__(self):
+		return json.dumps({"event": self.event, "created": self.created.isoformat(), "actor": self.actor,
+			"iri": self.iri, "detail": self.detail})
+
+def owner_ids(instance):
+	"""The user id of the IRI's owner, read from the profile when it is already loaded."""
+	if instance.userprofile_id is None:
+		return []
+	profile = getattr(instance, instance._meta.get_field('userprofile').get_cache_name(), None)
+	if profile is not None and profile.id == instance.userprofile_id:
+		return [profile.user_id]
+	return UserProfile.objects.filter(id=instance.userprofile_id).values_list('user_id', flat=True)
+
+@receiver(post_init, sender=RegisteredIRI)
+def iri_post_init(sender, **kwargs):
+	instance = kwargs['instance']
+	instance._review_state = (instance.accepted, instance.reviewed)
+
 @receiver(post_save, sender=RegisteredIRI)
 def iri_post_save(sender, **kwargs):
+	instance = kwargs['instance']
+	review_state = (instance.accepted, instance.reviewed)
+	if kwargs['created']:
+		queue_admin_notice("There is a new IRI (%s) waiting for you to review." % instance.return_address())
+		record_events(iri_events('registered', [instance]))
+	elif review_state != instance._review_state and instance.reviewed:
+		record_events(iri_events('accepted' if instance.accepted else 'rejected', [instance],
+			decided=not instance._review_state[1]))
 	if kwargs['created']:
-		notify_admins.delay(kwargs['instance'].return_address())
\ No newline at end of file
+		VocabularyCount.adjust(instance.vocabulary, instance.term_type, 1, int(instance.accepted))
+		triple = (instance.vocabulary, instance.term_type, instance.term)
+		transaction.on_commit(lambda: autocomplete_index.update(added=[triple]))
+	elif review_state[0] != instance._review_state[0]:
+		VocabularyCount.adjust(instance.vocabulary, instance.term_type, 0, 1 if instance.accepted else -1)
+	if kwargs['created'] or review_state != instance._review_state:
+		published = instance.accepted and instance.reviewed
+		if published != (not kwargs['created'] and all(instance._review_state)):
+			RedirectDelta.record([(instance.vocabulary, instance.term_type, instance.term)], published)
+			# Only with a compile to catch the artifact up, and ahead of it so
+			# the compile reads the new version; pending IRIs leave both alone
+			bump_registry_version()
+			routing_table.invalidate()
+			schedule_artifact_compile()
+			# A withdrawal may take the last published IRI of the vocabulary,
+			# so only publishes can skip a file that already lists it
+			schedule_htaccess_rebuild([instance.vocabulary] if published else None)
+		bump_user_iris_versions(owner_ids(instance))
+	instance._review_state = review_state
+
+@receiver(post_delete, sender=RegisteredIRI)
+def iri_post_delete(sender, **kwargs):
+	instance = kwargs['instance']
+	VocabularyCount.adjust(instance.vocabulary, instance.term_type, -1, -int(instance._review_state[0]))
+	triple = (instance.vocabulary, instance.term_type, instance.term)
+	if all(instance._review_state):
+		RedirectDelta.record([triple], False)
+		bump_registry_version()
+		routing_table.invalidate()
+		schedule_artifact_compile()
+		schedule_htaccess_rebuild()
+	record_events(iri_events('deleted', [instance]))
+	transaction.on_commit(lambda: autocomplete_index.update(removed=[triple]))
+	bump_user_iris_versions(owner_ids(instance))
@@ -0,0 +1,120 @@
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import mail
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+USER_NOTICE_SUBJECT = "Your xAPI vocabulary IRI has been processed"
+USER_NOTICE_BODY = ("Your IRI, %s, has been %s.\n"
+    "If it was rejected we most likely found the IRI already created in a different repository.\n"
+    "Please email helpdesk@adlnet.gov if you have any questions.")
+ADMIN_NOTICE_SUBJECT = "New IRI Alert"
+
+def queue_notice(recipients, subject, body):
+    from .models import EmailNotice
+    EmailNotice.objects.bulk_create([EmailNotice(recipient=recipient, subject=subject, body=body)
+        for recipient in recipients])
+
+def queue_user_notice(iri, email, accepted):
+    queue_notice([email], USER_NOTICE_SUBJECT, USER_NOTICE_BODY % (iri, "accepted" if accepted else "rejected"))
+
+def queue_user_notices(notices):
+    """Queue (iri, email, accepted) notices with a single insert."""
+    from .models import EmailNotice
+    EmailNotice.objects.bulk_create([EmailNotice(recipient=email, subject=USER_NOTICE_SUBJECT,
+        body=USER_NOTICE_BODY % (iri, "accepted" if accepted else "rejected")) for iri, email, accepted in notices])
+
+def queue_admin_notice(body):
+    queue_notice([email for _, email in settings.ADMINS], settings.EMAIL_SUBJECT_PREFIX + ADMIN_NOTICE_SUBJECT, body)
+
+def build_digest(notices):
+    """Fold every notice queued for one recipient into a single message."""
+    if len(notices) == 1:
+        return notices[0].subject, notices[0].body
+    subject = "%sxAPI vocabulary registry: %d notifications" % (settings.EMAIL_SUBJECT_PREFIX, len(notices))
+    body = "\n\n----------\n\n".join("%s\n\n%s" % (notice.subject, notice.body) for notice in notices)
+    return subject, body
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), settings.OUTBOX_RETRY_MAX_DELAY))
+
+def record_failure(notices, error):
+    """Retry one recipient's notices later, or give up on them at OUTBOX_MAX_ATTEMPTS."""
+    from .models import EmailNotice
+    attempts = max(notice.attempts for notice in notices) + 1
+    EmailNotice.objects.filter(id__in=[notice.id for notice in notices]).update(attempts=attempts,
+        next_attempt=timezone.now() + retry_delay(attempts), last_error=str(error))
+    if attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        for notice in notices:
+            logger.error("Outbox gave up on notice %d (%s) to %s after %d attempts: %s" % (notice.id,
+                notice.subject, notice.recipient, attempts, error))
+
+def claim_notices(now=None):
+    """Claim up to OUTBOX_BATCH_SIZE due notices for one drain and return them.
+
+    The claiming UPDATE moves next_attempt OUTBOX_CLAIM_TIMEOUT seconds
+    ahead. A concurrent drain's UPDATE waits for the row locks and then
+    re-checks next_attempt, so it skips every row this one got, whichever
+    worker or process it runs in.
+    """
+    from .models import EmailNotice
+    now = now or timezone.now()
+    due = EmailNotice.objects.filter(sent__isnull=True, next_attempt__lte=now,
+        attempts__lt=settings.OUTBOX_MAX_ATTEMPTS)
+    ids = list(due.order_by('id').values_list('id', flat=True)[:settings.OUTBOX_BATCH_SIZE])
+    if not ids:
+        return []
+    claim = uuid.uuid4().hex
+    due.filter(id__in=ids).update(claim=claim,
+        next_attempt=now + timedelta(seconds=getattr(settings, 'OUTBOX_CLAIM_TIMEOUT', 60 * 60)))
+    return list(EmailNotice.objects.filter(id__in=ids, claim=claim).order_by('id'))
+
+def drain_outbox(connection=None):
+    """Send every due notice, one digest per recipient, over one connection.
+
+    Only the notices claimed by claim_notices are sent, so drains running at
+    the same time (or a task redelivered under acks_late) never send a row
+    twice. Failed recipients, or every recipient when the mail server can't
+    be reached, are retried with exponential backoff until
+    OUTBOX_MAX_ATTEMPTS is reached. Returns the number of digests sent.
+    """
+    from .models import EmailNotice
+    by_recipient = OrderedDict()
+    for notice in claim_notices():
+        by_recipient.setdefault(notice.recipient, []).append(notice)
+    if not by_recipient:
+        return 0
+
+    connection = connection or mail.get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        # A failed attempt for every claimed notice, or an outage would push
+        # them OUTBOX_CLAIM_TIMEOUT ahead forever without counting
+        logger.exception("Outbox could not connect to the mail server")
+        for notices in by_recipient.values():
+            record_failure(notices, e)
+        return 0
+    sent = 0
+    try:
+        for recipient, notices in by_recipient.items():
+            subject, body = build_digest(notices)
+            message = mail.EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [recipient],
+                connection=connection)
+            ids = [notice.id for notice in notices]
+            try:
+                connection.send_messages([message])
+            except Exception as e:
+                logger.exception("Outbox send to %s failed" % recipient)
+                record_failure(notices, e)
+            else:
+                EmailNotice.objects.filter(id__in=ids).update(sent=timezone.now())
+                sent += 1
+    finally:
+        connection.close()
+    return sent
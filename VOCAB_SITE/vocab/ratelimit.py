@@ -0,0 +1,157 @@
+"""Rate limits for the expensive views.
+
+Each RATELIMITS entry lets every client make burst requests per window of
+burst / rate, which is the same long run rate; past that a request is
+answered 429 with a Retry-After of the time until it would pass. Clients are
+the user id when logged in and the IP otherwise.
+
+Requests are counted per fixed window, one counter taken with an atomic add
+or incr so parallel requests from one client can't all read the same count
+and pass. On their own, fixed windows let a client send burst requests at the
+end of one window and burst more at the start of the next. So a request is
+checked against a sliding window instead, approximated from two counters:
+the current window's count plus the previous window's, weighted by how much
+of the previous window the sliding one still covers. That is exact when the
+previous window's requests were spread evenly. Refused requests are taken off
+the count again, so a client that waits out Retry-After gets through.
+
+Counters live in the shared cache, which every process counts against, or
+with RATELIMIT_STORE = 'local' in a dict per process, which costs no network
+round trip but multiplies the limits by the process count.
+"""
+import math
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+RATELIMIT_KEY = 'vocab:ratelimit:%s:%s:%d'
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+def parse_rate(rate):
+    """'30/m' -> seconds between requests."""
+    count, period = rate.split('/')
+    return PERIODS[period] / float(count)
+
+class LocalStore(object):
+    """Per-process counters with the cache's add/incr; expired ones are dropped once max_keys is reached."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, value, timeout):
+        with self._lock:
+            now = time.time()
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > now:
+                return False
+            if len(self._data) >= self.max_keys and key not in self._data:
+                for stale in [k for k, (_, expires) in self._data.items() if expires <= now]:
+                    del self._data[stale]
+            self._data[key] = [value, now + timeout]
+            return True
+
+    def incr(self, key, delta=1):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.time():
+                raise ValueError("Key '%s' not found" % key)
+            entry[0] += delta
+            return entry[0]
+
+    def decr(self, key, delta=1):
+        return self.incr(key, -delta)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.time():
+                return default
+            return entry[0]
+
+class RateLimiter(object):
+    def __init__(self, store=None):
+        self.store = store
+        self._local = LocalStore()
+        self._stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    def _store(self):
+        if self.store is not None:
+            return self.store
+        return self._local if getattr(settings, 'RATELIMIT_STORE', 'cache') == 'local' else cache
+
+    def hit(self, name, client, rate, burst, now=None):
+        """Count a request by client against name. Returns 0, or seconds to wait."""
+        window = parse_rate(rate) * burst
+        now = time.time() if now is None else now
+        index = int(now // window)
+        elapsed = now - index * window
+        key = RATELIMIT_KEY % (name, client, index)
+        store = self._store()
+        # Kept through the next window, which reads it as the previous count
+        timeout = int(math.ceil(window * 2)) + 1
+        if store.add(key, 1, timeout):
+            count = 1
+        else:
+            try:
+                count = store.incr(key)
+            except ValueError:
+                # Expired between the add and the incr
+                store.add(key, 1, timeout)
+                count = 1
+        previous = store.get(RATELIMIT_KEY % (name, client, index - 1)) or 0
+        if count + previous * (1 - elapsed / window) > burst:
+            try:
+                store.decr(key)
+            except ValueError:
+                pass
+            self._record(name, 'limited')
+            if count > burst:
+                # Into the next window, until this window's share has dropped enough
+                return window - elapsed + window * (1 - float(burst - 1) / (count - 1))
+            # Until the previous window's share has dropped enough
+            return window * (1 - float(burst - count) / previous) - elapsed
+        self._record(name, 'allowed')
+        return 0
+
+    def _record(self, name, stat):
+        with self._stats_lock:
+            self._stats[(name, stat)] += 1
+
+    def snapshot(self):
+        with self._stats_lock:
+            return sorted(self._stats.items())
+
+rate_limiter = RateLimiter()
+
+def client_id(request):
+    if request.user.is_authenticated():
+        return 'user-%s' % request.user.id
+    address = request.META.get(getattr(settings, 'RATELIMIT_IP_HEADER', 'REMOTE_ADDR'), '')
+    # X-Forwarded-For style headers are appended to by each proxy, only the
+    # last entry (added by ours) isn't whatever the client chose to send
+    return 'ip-%s' % address.split(',')[-1].strip()
+
+def rate_limited(name, methods=('GET', 'POST')):
+    """Limit the view's requests with one of methods to RATELIMITS[name] per client."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            limit = getattr(settings, 'RATELIMITS', {}).get(name)
+            if limit and request.method in methods and getattr(settings, 'RATELIMIT_ENABLED', True):
+                wait = rate_limiter.hit(name, client_id(request), limit['rate'], limit.get('burst', 1))
+                if wait:
+                    response = HttpResponse("Too many requests, try again later.\n", status=429,
+                        content_type='text/plain')
+                    response['Retry-After'] = str(int(math.ceil(wait)))
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,101 @@
+"""Versioned published redirect set.
+
+Every change to the set of accepted, reviewed IRIs is recorded as a
+RedirectDelta, stamped with the registry version it was published at once
+its transaction commits (see RedirectDelta.stamp). compact_redirects
+folds the deltas into a numbered RedirectSnapshot and prunes what no longer
+needs keeping, and redirect_changes answers "what changed since version N",
+so resolver and Apache nodes converge by fetching a handful of deltas instead
+of rereading the registry.
+"""
+import json
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import registry_version
+from .models import RedirectDelta, RedirectSnapshot, RegisteredIRI, iri_address
+from .resolver import route_targets
+
+def published_triples():
+    return set(RegisteredIRI.objects.filter(accepted=True, reviewed=True).values_list('vocabulary', 'term_type', 'term'))
+
+def apply_deltas(triples, deltas):
+    for delta in deltas:
+        triple = (delta.vocabulary, delta.term_type, delta.term)
+        if delta.published:
+            triples.add(triple)
+        else:
+            triples.discard(triple)
+    return triples
+
+@transaction.atomic
+def compact_redirects():
+    """Fold the deltas into a new snapshot and prune old ones.
+
+    First stamps any delta whose transaction committed without running its
+    stamp (e.g. the process died in between). The first snapshot is read
+    from the registry itself, which also covers IRIs accepted before deltas
+    were recorded. Applying a delta is idempotent, so one already reflected
+    in the registry read does no harm. Keeps the newest
+    REDIRECT_SNAPSHOTS_KEPT snapshots and the deltas after the oldest of
+    them. Returns the latest snapshot.
+    """
+    if RedirectDelta.objects.filter(version=None).exists():
+        RedirectDelta.stamp()
+    version = registry_version()
+    latest = RedirectSnapshot.objects.order_by('-version').first()
+    if latest is None:
+        triples = published_triples()
+    elif latest.version >= version or not deltas_between(latest.version, version).exists():
+        return latest
+    else:
+        triples = apply_deltas(latest.triples(), deltas_between(latest.version, version))
+
+    # A concurrent compaction may have written this version already
+    latest, _ = RedirectSnapshot.objects.get_or_create(version=version,
+        defaults={'routes': json.dumps(sorted(triples)), 'size': len(triples)})
+    kept = list(RedirectSnapshot.objects.order_by('-version')
+        .values_list('version', flat=True)[:getattr(settings, 'REDIRECT_SNAPSHOTS_KEPT', 3)])
+    RedirectSnapshot.objects.filter(version__lt=kept[-1]).delete()
+    RedirectDelta.objects.filter(version__lte=kept[-1]).delete()
+    return latest
+
+def deltas_between(since, version):
+    return RedirectDelta.objects.filter(version__gt=since, version__lte=version).order_by('version', 'id')
+
+def route_json(triple, published=True, targets=None):
+    vocabulary, term_type, term = triple
+    json_redirect, html_redirect = route_targets(vocabulary, term_type, term, targets)
+    data = {"vocabulary": vocabulary, "term_type": term_type, "term": term, "published": published,
+        "iri": iri_address(*triple)}
+    if published:
+        data.update({"jsonld": json_redirect, "html": html_redirect})
+    return data
+
+def redirect_changes(since=None):
+    """Everything a node at version since needs to reach the current version.
+
+    A node that is up to date enough gets only the deltas after since; a new
+    node, or one older than the oldest kept snapshot, gets the latest
+    snapshot plus the deltas after it. Read only: until compact_redirects
+    has written the first snapshot, a new node's snapshot is read from the
+    registry, after the version, so at worst it already holds a delta it is
+    sent again.
+    """
+    version = registry_version()
+    oldest = RedirectSnapshot.objects.order_by('version').first()
+    targets = {}
+    data = {"version": version}
+    if oldest is None and since is None:
+        since = version
+        data["snapshot"] = {"version": version,
+            "routes": [route_json(triple, targets=targets) for triple in sorted(published_triples())]}
+    elif oldest is not None and (since is None or since < oldest.version):
+        snapshot = RedirectSnapshot.objects.order_by('-version').first()
+        since = snapshot.version
+        data["snapshot"] = {"version": snapshot.version,
+            "routes": [route_json(triple, targets=targets) for triple in sorted(snapshot.triples())]}
+    data["deltas"] = [dict(route_json((delta.vocabulary, delta.term_type, delta.term), delta.published, targets),
+        version=delta.version) for delta in deltas_between(since, version)]
+    return data
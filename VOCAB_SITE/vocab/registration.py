@@ -0,0 +1,156 @@
+from django.db import connection, transaction
+
+from .artifact import schedule_artifact_compile
+from .audit import iri_events, record_events
+from .autocomplete import autocomplete_index
+from .cache import bump_registry_version, bump_user_iris_versions
+from .db import supports_on_conflict
+from .forms import RegisteredIRIForm
+from .htaccess import schedule_htaccess_rebuild
+from .models import RedirectDelta, RegisteredIRI
+from .outbox import queue_admin_notice
+from .resolver import routing_table
+from .tree import adjust_counts
+
+BULK_BATCH_SIZE = 500
+
+def existing_triples(triples):
+    """Return the subset of triples that already have a RegisteredIRI row."""
+    triples = set(triples)
+    if not triples:
+        return set()
+    vocabularies = set(vocabulary for vocabulary, _, _ in triples)
+    rows = RegisteredIRI.objects.filter(vocabulary__in=vocabularies) \
+        .values_list('vocabulary', 'term_type', 'term')
+    return triples.intersection(rows)
+
+def insert_ignoring_conflicts(iris):
+    """INSERT ... ON CONFLICT DO NOTHING the unsaved iris (Postgres 9.5+).
+
+    Rows another transaction already committed, or is inserting right now,
+    are skipped by the database instead of raising IntegrityError, so parallel
+    submitters never abort or serialize each other and no savepoints are
+    needed. Returns the set of triples that were actually inserted.
+    """
+    meta = RegisteredIRI._meta
+    fields = [meta.get_field(name) for name in ('vocabulary', 'term_type', 'term', 'accepted', 'reviewed',
+        'userprofile', 'address', 'created')]
+    qn = connection.ops.quote_name
+    inserted = set()
+    with connection.cursor() as cursor:
+        for start in range(0, len(iris), BULK_BATCH_SIZE):
+            batch = iris[start:start + BULK_BATCH_SIZE]
+            placeholders = ", ".join(["(%s)" % ", ".join(["%s"] * len(fields))] * len(batch))
+            params = []
+            for iri in batch:
+                params.extend(field.get_db_prep_save(getattr(iri, field.attname), connection) for field in fields)
+            cursor.execute("INSERT INTO %s (%s) VALUES %s ON CONFLICT (%s) DO NOTHING RETURNING %s, %s, %s, %s" % (
+                qn(meta.db_table), ", ".join(qn(field.column) for field in fields), placeholders,
+                ", ".join(qn(name) for name in ('vocabulary', 'term_type', 'term')),
+                qn(meta.pk.column), qn('vocabulary'), qn('term_type'), qn('term')), params)
+            ids = dict(((vocabulary, term_type, term), pk) for pk, vocabulary, term_type, term in cursor.fetchall())
+            for iri in batch:
+                triple = (iri.vocabulary, iri.term_type, iri.term)
+                if triple in ids:
+                    iri.pk = ids[triple]
+                    inserted.add(triple)
+    return inserted
+
+def register_iris(profile, triples, accepted=False, notify=True):
+    """Register every (vocabulary, term_type, term) triple for profile in one pass.
+
+    Triples that already exist are reported back as conflicts instead of
+    tripping the unique_together constraint. On Postgres the conflict check
+    is done by the insert itself (see insert_ignoring_conflicts); elsewhere
+    existing rows are filtered out with one query before a bulk_create.
+    Neither path sends post_save, so the admins get a single notice for the
+    whole batch rather than one per IRI, or none with notify=False. With
+    accepted=True the IRIs are published straight away, skipping review.
+    Returns (created, conflicts) as lists of RegisteredIRI instances and
+    triples respectively.
+    """
+    seen = set()
+    candidates = []
+    for vocabulary, term_type, term in triples:
+        if (vocabulary, term_type, term) not in seen:
+            seen.add((vocabulary, term_type, term))
+            iri = RegisteredIRI(vocabulary=vocabulary, term_type=term_type, term=term, userprofile=profile,
+                accepted=accepted, reviewed=accepted)
+            iri.address = iri.build_address()
+            candidates.append(iri)
+
+    if supports_on_conflict():
+        inserted = insert_ignoring_conflicts(candidates)
+        created = [iri for iri in candidates if (iri.vocabulary, iri.term_type, iri.term) in inserted]
+    else:
+        taken = existing_triples(seen)
+        created = [iri for iri in candidates if (iri.vocabulary, iri.term_type, iri.term) not in taken]
+        RegisteredIRI.objects.bulk_create(created, batch_size=BULK_BATCH_SIZE)
+    created_triples = set((iri.vocabulary, iri.term_type, iri.term) for iri in created)
+    conflicts = [(iri.vocabulary, iri.term_type, iri.term) for iri in candidates
+        if (iri.vocabulary, iri.term_type, iri.term) not in created_triples]
+
+    if created:
+        adjust_counts(created, total=1, accepted=int(accepted))
+        transaction.on_commit(lambda: autocomplete_index.update(added=created_triples))
+        bump_user_iris_versions([profile.user_id])
+        events = iri_events('registered', created, profile.user.username)
+        if accepted:
+            events += iri_events('accepted', created, profile.user.username, detail="Published without review")
+        record_events(events)
+        if accepted:
+            RedirectDelta.record(created_triples, True)
+            bump_registry_version()
+            routing_table.invalidate()
+            schedule_htaccess_rebuild(set(vocabulary for vocabulary, _, _ in created_triples))
+            schedule_artifact_compile()
+    if created and notify:
+        queue_admin_notice("There are %d new IRIs waiting for you to review:\n\n%s" % (len(created),
+            "\n".join(iri.return_address() for iri in created)))
+    return created, conflicts
+
+def parse_vocabulary_upload(data):
+    """Validate an uploaded vocabulary and return (triples, errors).
+
+    data is either a list of {"vocabulary", "term_type", "term"} objects or a
+    single {"vocabulary": ..., "terms": [{"term_type", "term"}, ...]} object.
+    Each entry goes through RegisteredIRIForm so uploads follow the same rules
+    as the createIRI formset.
+    """
+    entries = upload_entries(data)
+    if entries is None:
+        return [], [{'index': None, 'errors': 'Expected a JSON object or list'}]
+
+    triples = []
+    errors = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            errors.append({'index': index, 'errors': 'Expected a JSON object'})
+            continue
+        triple, entry_errors = clean_triple(entry)
+        if entry_errors:
+            errors.append({'index': index, 'errors': entry_errors})
+        else:
+            triples.append(triple)
+    return triples, errors
+
+def upload_entries(data):
+    """The list of entries in either upload shape, or None if data is neither."""
+    if isinstance(data, dict):
+        vocabulary = data.get('vocabulary', '')
+        return [dict(term, vocabulary=vocabulary) for term in data.get('terms', []) if isinstance(term, dict)]
+    elif isinstance(data, list):
+        return data
+    return None
+
+def clean_triple(entry):
+    """Run one {"vocabulary", "term_type", "term"} entry through RegisteredIRIForm.
+
+    Returns (triple, None), or (None, form errors) if the entry is invalid.
+    """
+    # The unique check is done for the whole batch by register_iris
+    form = RegisteredIRIForm({'vocabulary': entry.get('vocabulary', ''),
+        'term_type': entry.get('term_type', ''), 'term': entry.get('term', '')}, check_unique=False)
+    if not form.is_valid():
+        return None, form.errors
+    return (form.cleaned_data['vocabulary'], form.cleaned_data['term_type'], form.cleaned_data['term']), None
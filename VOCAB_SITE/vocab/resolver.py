@@ -0,0 +1,136 @@
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .artifact import redirect_artifact
+from .cache import registry_version
+from .db import read_database
+from .htaccess import redirect_targets
+
+# Same negotiation as HTACCESS_SECTION_TEMPLATE
+JSONLD_ACCEPT = re.compile(r'application/ld\+json')
+RDF_BEFORE_HTML_ACCEPT = re.compile(r'application/rdf\+xml.*(text/html|application/xhtml\+xml)')
+HTML_ACCEPT = re.compile(r'text/html|application/xhtml\+xml')
+BROWSER_USER_AGENT = re.compile(r'^Mozilla/')
+
+def wants_html(accept, user_agent):
+    if JSONLD_ACCEPT.search(accept):
+        return False
+    if RDF_BEFORE_HTML_ACCEPT.search(accept):
+        return False
+    return bool(HTML_ACCEPT.search(accept) or BROWSER_USER_AGENT.match(user_agent))
+
+def route_targets(vocabulary, term_type, term, targets=None):
+    """Return (json-ld target, html target) for an IRI.
+
+    targets memoizes redirect_targets per vocabulary when building many routes.
+    """
+    if targets is None:
+        targets = {}
+    if vocabulary not in targets:
+        targets[vocabulary] = redirect_targets(vocabulary)
+    json_redirect, html_redirect = targets[vocabulary]
+    fragment = term or term_type
+    if fragment:
+        html_redirect = "%s/#%s" % (html_redirect, fragment)
+    return json_redirect, html_redirect
+
+class RoutingTable(object):
+    """In-memory map of accepted (vocabulary, term_type, term) triples to redirects.
+
+    The table is loaded with one query and then answers every lookup from a
+    dict. It reloads when the registry version moves, which is checked at most
+    every RESOLVER_REFRESH_INTERVAL seconds, so steady state resolution costs
+    one version lookup per interval rather than one query per request. The
+    shared redirect artifact takes over whenever it is as new as that
+    version, and the table is dropped until the artifact falls behind again.
+    """
+
+    def __init__(self, refresh_interval=None):
+        self.refresh_interval = refresh_interval if refresh_interval is not None else \
+            getattr(settings, 'RESOLVER_REFRESH_INTERVAL', 5)
+        self._routes = None
+        self._version = None
+        self._latest = None
+        self._checked = 0
+        self._reload_at = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        from .models import RegisteredIRI
+        rows = RegisteredIRI.objects.using(read_database()).filter(accepted=True, reviewed=True) \
+            .values_list('vocabulary', 'term_type', 'term').iterator()
+        routes = {}
+        targets = {}
+        for vocabulary, term_type, term in rows:
+            routes[(vocabulary, term_type, term)] = route_targets(vocabulary, term_type, term, targets)
+        return routes
+
+    def reload(self, settle=True):
+        with self._lock:
+            version = registry_version()
+            # Swap the whole dict so readers never see a half built table
+            routes = self._routes = self.build()
+            self._version = self._latest = version
+            self._checked = time.time()
+            # A replica may not have replayed the change that moved the
+            # version yet, so load once more when it should have
+            self._reload_at = None
+            if settle and getattr(settings, 'DATABASE_REPLICAS', []):
+                self._reload_at = self._checked + getattr(settings, 'DATABASE_REPLICA_LAG', 10)
+        return routes
+
+    def invalidate(self):
+        """Read the registry version again on the next lookup, once the change commits."""
+        def expire():
+            self._checked = 0
+        transaction.on_commit(expire)
+
+    def latest_version(self):
+        """registry_version(), read again at most every refresh interval."""
+        now = time.time()
+        if self._latest is None or now - self._checked >= self.refresh_interval:
+            self._checked = now
+            self._latest = registry_version()
+        return self._latest
+
+    def _refresh(self):
+        routes = self._routes
+        if routes is None:
+            return self.reload()
+        if self._reload_at is not None and time.time() >= self._reload_at:
+            return self.reload(settle=False)
+        if self.latest_version() != self._version:
+            return self.reload()
+        return routes
+
+    def _artifact(self):
+        """The shared redirect artifact (see artifact.py), unless it is stale.
+
+        A compile that failed or hasn't run yet leaves an artifact older than
+        the registry, which would 404 the IRIs accepted since; this process's
+        own table answers until the artifact catches up.
+        """
+        artifact = redirect_artifact.current()
+        if artifact is None or artifact.version < self.latest_version():
+            return None
+        self._routes = None
+        return artifact
+
+    def lookup(self, vocabulary, term_type='', term=''):
+        """Return (json-ld target, html target) or None for unknown triples."""
+        artifact = self._artifact()
+        if artifact is not None:
+            return artifact.lookup(vocabulary, term_type, term)
+        return self._refresh().get((vocabulary, term_type or '', term or ''))
+
+    def __len__(self):
+        artifact = self._artifact()
+        if artifact is not None:
+            return len(artifact)
+        return len(self._refresh())
+
+routing_table = RoutingTable()
@@ -0,0 +1,69 @@
+from django.db import transaction
+
+from .artifact import schedule_artifact_compile
+from .audit import iri_events, record_events
+from .cache import bump_registry_version, bump_user_iris_versions
+from .htaccess import schedule_htaccess_rebuild
+from .models import RedirectDelta, RegisteredIRI
+from .outbox import queue_user_notices
+from .resolver import routing_table
+from .tree import adjust_counts
+
+REVIEW_PAGE_SIZE = 50
+
+def pending_iris(after=None, page_size=REVIEW_PAGE_SIZE):
+    """Return one page of the review queue and whether there is another.
+
+    Keyset pagination on id walks the (reviewed, accepted, id) index, so every
+    page costs the same however deep into the queue the admin is.
+    """
+    iris = RegisteredIRI.objects.filter(accepted=False, reviewed=False).select_related('userprofile__user') \
+        .order_by('id')
+    if after:
+        iris = iris.filter(id__gt=after)
+    iris = list(iris[:page_size + 1])
+    return iris[:page_size], len(iris) > page_size
+
+def review_iris(ids, accepted, notify=True, actor=''):
+    """Accept or reject the pending IRIs in ids with a single UPDATE.
+
+    queryset.update() doesn't send post_save, so this does what the
+    RegisteredIRI receivers would have done once for the whole batch, then
+    records the redirect deltas, schedules one htaccess rebuild, queues
+    every owner notice with one insert (unless notify is False) and logs the
+    decisions as actor's. Returns the reviewed IRIs.
+
+    The rows are locked first, so when two admins review the same page the
+    second waits for the first to commit and then only gets the rows that
+    are still pending; nothing is counted, published or notified twice.
+    """
+    with transaction.atomic():
+        # Locked without select_related, which would lock the owners' rows too
+        locked = list(RegisteredIRI.objects.select_for_update().filter(id__in=ids, reviewed=False)
+            .values_list('id', flat=True))
+        if not locked:
+            return []
+        iris = list(RegisteredIRI.objects.filter(id__in=locked).select_related('userprofile__user'))
+        RegisteredIRI.objects.filter(id__in=locked).update(accepted=accepted, reviewed=True)
+
+        for iri in iris:
+            iri.accepted = accepted
+            iri.reviewed = True
+            iri._review_state = (accepted, True)
+        record_events(iri_events('accepted' if accepted else 'rejected', iris, actor, decided=True))
+        if accepted:
+            adjust_counts(iris, accepted=1)
+            RedirectDelta.record([(iri.vocabulary, iri.term_type, iri.term) for iri in iris], True)
+            bump_registry_version()
+            routing_table.invalidate()
+            schedule_htaccess_rebuild(set(iri.vocabulary for iri in iris))
+            schedule_artifact_compile()
+
+        bump_user_iris_versions(iri.userprofile.user_id for iri in iris if iri.userprofile)
+
+        if notify:
+            notices = [(iri.return_address(), iri.userprofile.user.email, accepted) for iri in iris
+                if iri.userprofile and iri.userprofile.user.email]
+            if notices:
+                queue_user_notices(notices)
+    return iris
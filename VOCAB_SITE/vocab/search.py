@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .db import read_database
+from .models import RegisteredIRI
+
+RESULTS_PER_PAGE = 25
+
+def _split_query(search_term):
+    # Users paste whole IRIs as often as bare terms, so strip the domain and
+    # treat anything with slashes as a vocabulary/term_type/term prefix
+    search_term = search_term.strip()
+    if search_term.startswith(settings.IRI_DOMAIN):
+        search_term = search_term[len(settings.IRI_DOMAIN):]
+    return [part for part in search_term.strip("/").split("/") if part]
+
+def search_iris(search_term):
+    """Return accepted IRIs matching search_term, best matches first.
+
+    Only prefix lookups are used so Postgres can answer from the
+    varchar_pattern_ops indexes on vocabulary, term_type and term instead of
+    scanning the table with LIKE '%x%'. Searches read from a replica.
+    """
+    parts = _split_query(search_term)
+    iris = RegisteredIRI.objects.using(read_database()).filter(accepted=True)
+    # No IRI has more than three path segments, so a longer path can't match
+    if not parts or len(parts) > 3:
+        return iris.none()
+
+    if len(parts) > 1:
+        # A path narrows each column in turn: exact on the leading parts,
+        # prefix on the last one
+        fields = ['vocabulary', 'term_type', 'term'][:len(parts)]
+        lookups = dict(zip(fields[:-1], parts[:-1]))
+        lookups[fields[-1] + '__startswith'] = parts[-1]
+        iris = iris.filter(**lookups)
+        rank = Case(When(Q(**{fields[-1]: parts[-1]}), then=Value(3)), default=Value(1),
+            output_field=IntegerField())
+    else:
+        word = parts[0]
+        iris = iris.filter(Q(vocabulary__startswith=word) | Q(term_type__startswith=word) | Q(term__startswith=word))
+        rank = Case(
+            When(term=word, then=Value(3)),
+            When(vocabulary=word, then=Value(2)),
+            default=Value(1),
+            output_field=IntegerField())
+    return iris.annotate(rank=rank).order_by('-rank', 'vocabulary', 'term_type', 'term')
@@ -0,0 +1,57 @@
+// Completes the vocabulary and term inputs of the createIRI formset and warns
+// about names that are taken or close to existing ones. The inputs are found
+// by name so forms added with "Add IRI" are covered too.
+$(document).ready(function(){
+    var forms = $('div.forms');
+    var url = forms.data('autocomplete-url');
+    var timer;
+
+    function hint(input) {
+        var span = input.next('.autocomplete-hint');
+        if (!span.length) {
+            span = $('<span class="autocomplete-hint text-warning"></span>').insertAfter(input);
+        }
+        return span;
+    }
+
+    function complete(input) {
+        var name = input.attr('name');
+        var prefix = name.replace(/-(vocabulary|term)$/, '');
+        var field = /-vocabulary$/.test(name) ? 'vocabulary' : 'term';
+        var value = $.trim(input.val());
+        if (!value) {
+            hint(input).text('');
+            return;
+        }
+        $.getJSON(url, {
+            field: field,
+            q: value,
+            vocabulary: $('[name="' + prefix + '-vocabulary"]').val(),
+            term_type: $('[name="' + prefix + '-term_type"]').val()
+        }, function(data) {
+            var listId = input.attr('id') + '-matches';
+            var list = $('#' + listId);
+            if (!list.length) {
+                list = $('<datalist></datalist>').attr('id', listId).insertAfter(input);
+                input.attr('list', listId);
+            }
+            list.empty();
+            $.each(data.matches, function(i, match) {
+                list.append($('<option></option>').attr('value', match));
+            });
+            var message = '';
+            if (data.exists) {
+                message = field == 'term' ? 'Already registered' : 'Existing vocabulary';
+            } else if (data.suggestions.length) {
+                message = 'Did you mean ' + data.suggestions.join(', ') + '?';
+            }
+            hint(input).text(message);
+        });
+    }
+
+    forms.on('input', 'input[name$="-vocabulary"], input[name$="-term"]', function() {
+        var input = $(this);
+        clearTimeout(timer);
+        timer = setTimeout(function() { complete(input); }, 150);
+    });
+});
@@ -0,0 +1,107 @@
+"""Static file storage that bundles, minifies, fingerprints and precompresses.
+
+Used as STATICFILES_STORAGE, so collectstatic (run by manage.py buildstatic)
+leaves STATIC_ROOT holding, for every asset, a content-hashed copy that can
+be served with far-future cache headers, plus .gz (and .br, when the brotli
+module is installed) precompressed variants for the web server to pick from.
+"""
+import gzip
+import os
+import re
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.json', '.map')
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+CSS_SPACE = re.compile(r'\s+')
+CSS_PUNCTUATION_SPACE = re.compile(r'\s*([{};,>])\s*')
+
+def minify_css(css):
+    css = CSS_COMMENT.sub('', css)
+    css = CSS_SPACE.sub(' ', css)
+    # Spaces before ':' are left alone, "a :hover" and "a:hover" differ
+    css = CSS_PUNCTUATION_SPACE.sub(r'\1', css).replace(': ', ':')
+    return css.replace(';}', '}').strip() + '\n'
+
+def minify_js(js):
+    """Drop indentation, blank lines and whole-line // comments.
+
+    Line breaks are kept so automatic semicolon insertion still applies and
+    nothing inside a string or regex literal is touched.
+    """
+    lines = (line.strip() for line in js.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+MINIFIERS = {
+    '.css': minify_css,
+    '.js': minify_js,
+}
+
+def gzip_bytes(content):
+    out = BytesIO()
+    # mtime=0 keeps the output identical between builds
+    with gzip.GzipFile(filename='', mode='wb', fileobj=out, compresslevel=9, mtime=0) as compressed:
+        compressed.write(content)
+    return out.getvalue()
+
+class BundledManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage with STATIC_BUNDLES, minification and precompression.
+
+    Before hashing, each STATIC_BUNDLES entry is written as the concatenation
+    of its sources and every css/js file is minified, so the hashes and the
+    manifest cover exactly what is served.
+    """
+
+    def _replace(self, name, content):
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, ContentFile(content))
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            for bundle, sources in sorted(getattr(settings, 'STATIC_BUNDLES', {}).items()):
+                parts = []
+                for source in sources:
+                    storage, path = paths[source]
+                    with storage.open(path) as source_file:
+                        parts.append(source_file.read())
+                self._replace(bundle, b'\n'.join(parts))
+                paths[bundle] = (self, bundle)
+
+            for name in sorted(paths):
+                minify = MINIFIERS.get(os.path.splitext(name)[1])
+                if minify and '.min.' not in name:
+                    storage, path = paths[name]
+                    with storage.open(path) as source_file:
+                        content = source_file.read().decode('utf-8')
+                    self._replace(name, minify(content).encode('utf-8'))
+                    # Hash the minified copy rather than the app's original
+                    paths[name] = (self, name)
+
+        for name, hashed_name, processed in super(BundledManifestStaticFilesStorage, self).post_process(
+                paths, dry_run, **options):
+            if not dry_run and hashed_name and not isinstance(processed, Exception) and \
+                    os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+                self.precompress(hashed_name)
+            yield name, hashed_name, processed
+
+    def precompress(self, name):
+        with self.open(name) as original:
+            content = original.read()
+        variants = [('.gz', gzip_bytes)]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress))
+        for suffix, compress in variants:
+            compressed = compress(content)
+            # Not worth a second file if it saves nothing
+            if len(compressed) < len(content):
+                self._replace(name + suffix, compressed)
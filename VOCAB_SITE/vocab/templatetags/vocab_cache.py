@@ -0,0 +1,39 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+
+from ..cache import render_cache_key, render_cache_stats
+
+register = template.Library()
+
+class VersionCacheNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        key = render_cache_key('fragment', self.name, *[var.resolve(context) for var in self.vary_on])
+        content = cache.get(key)
+        render_cache_stats.record('fragment:' + self.name, content is not None)
+        if content is None:
+            content = self.nodelist.render(context)
+            cache.set(key, content, getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 600))
+        return content
+
+@register.tag('versioncache')
+def do_versioncache(parser, token):
+    """Cache a fragment until the registry version moves.
+
+        {% versioncache "name" [vary_on ...] %} ... {% endversioncache %}
+
+    Like {% cache %}, but the key includes the registry version, so the
+    fragment is re-rendered as soon as an IRI is accepted, not on a timer.
+    Querysets used only inside the block aren't evaluated on a hit.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError("'%s' takes at least a fragment name" % bits[0])
+    nodelist = parser.parse(('endversioncache',))
+    parser.delete_first_token()
+    return VersionCacheNode(nodelist, bits[1].strip('"\''), [parser.compile_filter(bit) for bit in bits[2:]])
@@ -0,0 +1,22 @@
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles.templatetags.staticfiles import static
+from django.utils.html import format_html_join
+
+register = template.Library()
+
+@register.simple_tag
+def static_bundle(bundle):
+    """Link a STATIC_BUNDLES bundle: its hashed build, or its sources while DEBUG.
+
+        {% static_bundle "vocab/css/site.css" %}
+
+    The bundle itself only exists in STATIC_ROOT after manage.py buildstatic,
+    so in development each source is linked on its own.
+    """
+    names = settings.STATIC_BUNDLES[bundle] if settings.DEBUG else [bundle]
+    if bundle.endswith('.js'):
+        markup = u'<script type="text/javascript" src="{}"></script>'
+    else:
+        markup = u'<link rel="stylesheet" href="{}">'
+    return format_html_join(u'\n', markup, ((static(name),) for name in names))
@@ -1,6 +1,49 @@
 # import threading
+import zlib
+import csv
+import io
+import json
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import zlib
+from datetime import timedelta
+from smtplib import SMTPException
 
-from django.test import TestCase
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import IntegrityError, connection, transaction
+from django.db.models.signals import pre_save
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from . import models, registration
+from .artifact import publish_redirect_artifact, redirect_artifact
+from .autocomplete import SortedIndex
+from .cache import cache_anonymous_page, check_shared_cache, user_iris_version
+from .db import supports_on_conflict
+from .export import RDF_TYPE, SKOS, accepted_rows, export_registry, iriref
+from .importer import JSONReader, read_jsonld
+from .models import EmailNotice, RedirectDelta, RedirectSnapshot, RegisteredIRI, RegistryVersion, UserProfile, \
+    VocabularyCount, iri_path
+from .outbox import USER_NOTICE_SUBJECT, claim_notices, drain_outbox, queue_notice
+from .ratelimit import RateLimiter, client_id
+from .redirects import compact_redirects, redirect_changes
+from .registration import register_iris
+from .resolver import RoutingTable
+from .review import review_iris
+from .search import search_iris
 
 # Create your tests here.
 # def test_concurrently(times):
@@ -39,3 +82,652 @@ from django.test import TestCase
 # 			self.client.login(username='lou', password='password')
 			
 # 		test_write()
+
+class SearchTest(TestCase):
+    def setUp(self):
+        for vocabulary, term_type, term in [('adl', '', ''), ('adl', 'verbs', 'answered'), ('adl', 'verbs', 'answer'),
+                ('answers', '', ''), ('tincan', 'verbs', 'adlib')]:
+            RegisteredIRI.objects.create(vocabulary=vocabulary, term_type=term_type, term=term, accepted=True,
+                reviewed=True)
+        RegisteredIRI.objects.create(vocabulary='adl', term_type='verbs', term='answering')
+
+    def addresses(self, search_term):
+        return [iri_path(iri.vocabulary, iri.term_type, iri.term) for iri in search_iris(search_term)]
+
+    def test_exact_matches_rank_first(self):
+        # Exact term, then exact vocabulary, then the other prefix matches
+        self.assertEqual(self.addresses('answer'), ['adl/verbs/answer', 'adl/verbs/answered', 'answers'])
+        self.assertEqual(self.addresses('adl'), ['adl', 'adl/verbs/answer', 'adl/verbs/answered', 'tincan/verbs/adlib'])
+
+    def test_paths(self):
+        self.assertEqual(self.addresses('adl/verbs/answer'), ['adl/verbs/answer', 'adl/verbs/answered'])
+        self.assertEqual(self.addresses('https://w3id.org/xapi/adl/verbs/answ'),
+            ['adl/verbs/answer', 'adl/verbs/answered'])
+        self.assertEqual(self.addresses('adl/verbs/answer/more'), [])
+        self.assertEqual(self.addresses(' / '), [])
+
+def formset_data(triples):
+    data = {'form-TOTAL_FORMS': str(len(triples)), 'form-INITIAL_FORMS': '0'}
+    for index, triple in enumerate(triples):
+        for field, value in zip(('vocabulary', 'term_type', 'term'), triple):
+            data['form-%d-%s' % (index, field)] = value
+    return data
+
+def without_on_conflict(test, module):
+    """Make module take its fallback path for the rest of test, whatever the database."""
+    original = module.supports_on_conflict
+    module.supports_on_conflict = lambda: False
+    test.addCleanup(setattr, module, 'supports_on_conflict', original)
+
+class RegisterIRIsTest(TestCase):
+    def setUp(self):
+        self.profile = UserProfile.objects.create(user=User.objects.create_user('a', 'a@example.com', 'pw'))
+        RegisteredIRI.objects.create(vocabulary='adl', term_type='verbs', term='voided')
+
+    def check_register(self):
+        created, conflicts = register_iris(self.profile, [('adl', '', ''), ('adl', 'verbs', 'voided'), ('adl', '', ''),
+            ('adl', 'verbs', 'answered')])
+        # A triple given twice is registered once and isn't a conflict
+        self.assertEqual([(iri.vocabulary, iri.term_type, iri.term) for iri in created],
+            [('adl', '', ''), ('adl', 'verbs', 'answered')])
+        self.assertEqual(conflicts, [('adl', 'verbs', 'voided')])
+        self.assertEqual(RegisteredIRI.objects.filter(userprofile=self.profile).count(), 2)
+        return created
+
+    def test_insert_ignoring_conflicts(self):
+        if not supports_on_conflict():
+            self.skipTest("INSERT ... ON CONFLICT needs Postgres 9.5+")
+        created = self.check_register()
+        # RETURNING gives the new rows their ids
+        self.assertTrue(all(iri.pk for iri in created))
+
+    def test_existing_rows_filtered_first(self):
+        without_on_conflict(self, registration)
+        self.check_register()
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage', RATELIMIT_ENABLED=False)
+class CreateIRITest(TestCase):
+    def setUp(self):
+        self.profile = UserProfile.objects.create(user=User.objects.create_user('a', 'a@example.com', 'pw'))
+        self.client.login(username='a', password='pw')
+        RegisteredIRI.objects.create(vocabulary='adl', term_type='verbs', term='voided')
+
+    def test_formset_reports_conflicts(self):
+        data = formset_data([('adl', '', ''), ('adl', 'verbs', 'voided'), ('adl', 'verbs', 'answered')])
+        response = self.client.post('/createIRI', data)
+        self.assertEqual(response.context['newiris'], ['https://w3id.org/xapi/adl',
+            'https://w3id.org/xapi/adl/verbs/answered'])
+        self.assertEqual(response.context['conflicts'], ['https://w3id.org/xapi/adl/verbs/voided'])
+        self.assertEqual(RegisteredIRI.objects.filter(userprofile=self.profile).count(), 2)
+
+        # Nothing left to create, the form comes back with every row marked
+        response = self.client.post('/createIRI', data)
+        self.assertEqual([form.non_field_errors() for form in response.context['formset']],
+            [["This IRI has already been registered."]] * 3)
+
+    def test_formset_rejects_repeated_triples(self):
+        response = self.client.post('/createIRI', formset_data([('tincan', '', ''), ('tincan', '', '')]))
+        self.assertTrue(response.context['formset'].non_form_errors())
+        self.assertFalse(RegisteredIRI.objects.filter(vocabulary='tincan').exists())
+
+    def upload(self, body):
+        return self.client.post('/createIRI/upload', body, content_type='application/json')
+
+    def test_signup_race(self):
+        def signup_first(sender, instance, **kwargs):
+            # Another request takes the username between the check and the insert
+            if instance.pk is None and instance.username == 'b':
+                User.objects.bulk_create([User(username='b', email='other@example.com')])
+        pre_save.connect(signup_first, sender=User)
+        self.addCleanup(pre_save.disconnect, signup_first, sender=User)
+        response = Client().post('/createUser', {'username': 'b', 'email': 'b@example.com', 'password': 'pw',
+            'password2': 'pw'})
+        self.assertEqual(response.context['error_message'], "User b already exists.")
+        # Refused like any taken username instead of failing with a 500
+        self.assertFalse(User.objects.filter(email='b@example.com').exists())
+        self.assertFalse(UserProfile.objects.filter(user__username='b').exists())
+
+    def test_upload(self):
+        response = self.upload(json.dumps({"vocabulary": "adl", "terms": [{"term_type": "verbs", "term": "voided"},
+            {"term_type": "verbs", "term": "answered"}]}))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content), {"created": ["https://w3id.org/xapi/adl/verbs/answered"],
+            "conflicts": ["https://w3id.org/xapi/adl/verbs/voided"]})
+
+    def test_upload_errors(self):
+        response = self.upload('[{"vocabulary": "adl"')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Invalid JSON", json.loads(response.content)["errors"])
+        response = self.upload(json.dumps([{"vocabulary": "adl", "term_type": "verbs", "term": "answered"},
+            {"vocabulary": "adl", "term": "answered"}, "adl"]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error["index"] for error in json.loads(response.content)["errors"]], [1, 2])
+        self.assertEqual(self.upload('{"vocabulary": "adl", "terms": []}').status_code, 400)
+        with override_settings(VOCAB_UPLOAD_MAX_SIZE=10):
+            self.assertEqual(self.upload('[{"vocabulary": "adl"}]').status_code, 413)
+        self.assertEqual(RegisteredIRI.objects.count(), 1)
+
+class ApiTest(TestCase):
+    def test_iri_answer_follows_the_etag(self):
+        iri = RegisteredIRI.objects.create(vocabulary='adl', term_type='verbs', term='voided')
+        response = self.client.get('/api/v1/iris/adl/verbs/voided')
+        self.assertEqual(response.status_code, 404)
+        # Accepted in another process: this process's cache tiers hold the 404
+        RegisteredIRI.objects.filter(pk=iri.pk).update(accepted=True, reviewed=True)
+        RegistryVersion.bump()
+        accepted = self.client.get('/api/v1/iris/adl/verbs/voided', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(accepted.status_code, 200)
+        self.assertNotEqual(accepted['ETag'], response['ETag'])
+        self.assertEqual(json.loads(accepted.content)['iri'], 'https://w3id.org/xapi/adl/verbs/voided')
+
+class ExportTest(TestCase):
+    def setUp(self):
+        for vocabulary, term_type, term in [('adl', '', ''), ('adl', 'verbs', 'voided'), ('my "vocab"', '', '')]:
+            RegisteredIRI.objects.create(vocabulary=vocabulary, term_type=term_type, term=term, accepted=True,
+                reviewed=True)
+        RegisteredIRI.objects.create(vocabulary='pending')
+
+    def export(self, fmt, gzip=False):
+        return b''.join(export_registry(fmt, gzip))
+
+    def test_iriref(self):
+        self.assertEqual(iriref(u'https://w3id.org/xapi/a b<c>"{d}|^`\\\x01'),
+            u'https://w3id.org/xapi/a%20b%3Cc%3E%22%7Bd%7D%7C%5E%60%5C%01')
+        self.assertEqual(iriref(u'https://w3id.org/xapi/caf\xe9'), u'https://w3id.org/xapi/caf\xe9')
+
+    def test_ntriples(self):
+        self.assertEqual(self.export('nt').decode('utf-8').splitlines(), [
+            '<https://w3id.org/xapi/adl> <%s> <%sConceptScheme> .' % (RDF_TYPE, SKOS),
+            '<https://w3id.org/xapi/adl/verbs/voided> <%s> <%sConcept> .' % (RDF_TYPE, SKOS),
+            '<https://w3id.org/xapi/adl/verbs/voided> <%sinScheme> <https://w3id.org/xapi/adl> .' % SKOS,
+            '<https://w3id.org/xapi/my%%20%%22vocab%%22> <%s> <%sConceptScheme> .' % (RDF_TYPE, SKOS)])
+
+    def test_csv_and_jsonld(self):
+        rows = list(csv.reader(io.BytesIO(self.export('csv'))))
+        self.assertEqual(rows, [['vocabulary', 'term_type', 'term', 'iri'],
+            ['adl', '', '', 'https://w3id.org/xapi/adl'],
+            ['adl', 'verbs', 'voided', 'https://w3id.org/xapi/adl/verbs/voided'],
+            ['my "vocab"', '', '', 'https://w3id.org/xapi/my "vocab"']])
+        graph = json.loads(self.export('jsonld'))['@graph']
+        self.assertEqual(graph[1], {"@id": "https://w3id.org/xapi/adl/verbs/voided", "@type": "skos:Concept",
+            "skos:inScheme": {"@id": "https://w3id.org/xapi/adl"}})
+        self.assertEqual([node["@type"] for node in graph], ["skos:ConceptScheme", "skos:Concept",
+            "skos:ConceptScheme"])
+
+    def test_chunks_and_gzip(self):
+        self.assertEqual(list(accepted_rows(chunk_size=1)), [('adl', '', ''), ('adl', 'verbs', 'voided'),
+            ('my "vocab"', '', '')])
+        self.assertEqual(zlib.decompress(self.export('nt', gzip=True), zlib.MAX_WBITS | 16), self.export('nt'))
+        response = self.client.get('/export.csv', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual((response['Content-Type'], response['Content-Encoding']), ('text/csv', 'gzip'))
+        self.assertEqual(zlib.decompress(b''.join(response.streaming_content), zlib.MAX_WBITS | 16),
+            self.export('csv'))
+
+class StaticBuildTest(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        source_dir = os.path.join(self.dir, 'src', 'test')
+        os.makedirs(source_dir)
+        for name, rule in (('a.css', 'a'), ('b.css', 'b')):
+            with open(os.path.join(source_dir, name), 'w') as source:
+                source.write(''.join('/* rule %d */\n%s.n%d {\n    color: red;\n}\n' % (n, rule, n) for n in range(50)))
+
+    def test_bundle_is_hashed_and_precompressed(self):
+        root = os.path.join(self.dir, 'root')
+        with self.settings(STATIC_ROOT=root, STATICFILES_DIRS=[os.path.join(self.dir, 'src')],
+                STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+                STATICFILES_STORAGE='vocab.storage.BundledManifestStaticFilesStorage',
+                STATIC_BUNDLES={'test/bundle.css': ['test/a.css', 'test/b.css']}):
+            call_command('buildstatic', stdout=StringIO())
+            with open(os.path.join(root, 'staticfiles.json')) as manifest:
+                hashed_name = json.load(manifest)['paths']['test/bundle.css']
+
+        self.assertNotEqual(hashed_name, 'test/bundle.css')
+        with open(os.path.join(root, hashed_name)) as bundle:
+            css = bundle.read()
+        # Both sources, minified
+        self.assertEqual(css.count('color:red'), 100)
+        self.assertNotIn('/*', css)
+        with open(os.path.join(root, hashed_name + '.gz'), 'rb') as compressed:
+            self.assertEqual(zlib.decompress(compressed.read(), 16 + zlib.MAX_WBITS).decode('utf-8'), css)
+
+class SortedIndexTest(TestCase):
+    def test_similar(self):
+        index = SortedIndex(['answered', 'Answered', 'answerd', 'asked', 'attempted'])
+        self.assertEqual(index.similar('answered'), ['Answered', 'answerd'])
+        self.assertEqual(index.similar('answred'), ['Answered', 'answered', 'answerd'])
+        index.remove('answered')
+        index.add('unanswered')
+        self.assertEqual(index.similar('answered'), ['Answered', 'answerd', 'unanswered'])
+
+class SharedCacheTest(TestCase):
+    def test_process_local_cache_is_refused(self):
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=locmem, CELERY_ALWAYS_EAGER=False):
+            self.assertRaises(ImproperlyConfigured, check_shared_cache)
+        with override_settings(CACHES=locmem, CELERY_ALWAYS_EAGER=True):
+            check_shared_cache()
+        memcached = {'default': {'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': '127.0.0.1:11211'}}
+        with override_settings(CACHES=memcached, CELERY_ALWAYS_EAGER=False):
+            check_shared_cache()
+
+class AnonymousPageCacheTest(TestCase):
+    def get(self, view, path):
+        request = RequestFactory().get(path)
+        request.user = AnonymousUser()
+        return view(request)
+
+    def test_shared_page_is_cached(self):
+        calls = []
+        @cache_anonymous_page
+        def page(request):
+            calls.append(request)
+            return HttpResponse("page")
+        self.get(page, '/shared')
+        self.get(page, '/shared')
+        self.assertEqual(len(calls), 1)
+
+    def test_personal_pages_are_not_cached(self):
+        calls = []
+        @cache_anonymous_page
+        def cookie(request):
+            calls.append(request)
+            response = HttpResponse("page")
+            response.set_cookie('seen', '1')
+            return response
+        @cache_anonymous_page
+        def token(request):
+            calls.append(request)
+            return HttpResponse(get_token(request))
+        for view in (cookie, token, cookie, token):
+            self.get(view, '/personal')
+        self.assertEqual(len(calls), 4)
+
+class JSONReaderTest(TestCase):
+    def test_graph_key_outside_the_top_level(self):
+        document = json.dumps({"@context": {"note": 'not "@graph": [here]', "@graph": {"@id": "@graph"}},
+            "@graph": [{"@id": "https://w3id.org/xapi/adl"}, {"@id": "https://w3id.org/xapi/adl/verbs/voided"}]})
+        self.assertEqual(list(read_jsonld(io.BytesIO(document))), [{'vocabulary': 'adl'},
+            {'vocabulary': 'adl', 'term_type': 'verbs', 'term': 'voided'}])
+        for read_size in (1, 7, 4096):
+            reader = JSONReader(io.BytesIO(document), read_size)
+            reader.seek_key('@graph')
+            self.assertEqual([node['@id'] for node in reader.items()], ["https://w3id.org/xapi/adl",
+                "https://w3id.org/xapi/adl/verbs/voided"])
+
+    def test_invalid_element_fails_without_reading_on(self):
+        stream = io.BytesIO(b'[{"a": 1}, {"a": nope}, ' + b'{"a": 2}, ' * 10000 + b'{}]')
+        reader = JSONReader(stream, read_size=1024)
+        items = reader.items()
+        self.assertEqual(next(items), {"a": 1})
+        self.assertRaises(ValueError, next, items)
+        self.assertEqual(stream.tell(), 1024)
+
+    def test_invalid_graph_node_fails_without_reading_on(self):
+        document = b'{"@context": {}, "@graph": [{"@id": "https://w3id.org/xapi/adl"}, {"@id": nope}, ' + \
+            b'{"@id": "https://w3id.org/xapi/adl/verbs/voided"}, ' * 10000 + b'{}]}'
+        for read_size in (1, 7, 4096):
+            stream = io.BytesIO(document)
+            reader = JSONReader(stream, read_size)
+            reader.seek_key('@graph')
+            items = reader.items()
+            self.assertEqual(next(items), {"@id": "https://w3id.org/xapi/adl"})
+            self.assertRaises(ValueError, next, items)
+            self.assertLessEqual(stream.tell(), 4096)
+
+    def test_values_split_between_reads(self):
+        stream = io.BytesIO(b'[{"a": "' + b'y' * 500 + b'", "b": [true, null, 1.5e3]}, "\\u00e9"]')
+        self.assertEqual(list(JSONReader(stream, read_size=3).items()), [{"a": "y" * 500, "b": [True, None, 1500.0]},
+            u"\xe9"])
+
+class PublishedFilesMixin(object):
+    """Publishes the htaccess files and the redirect artifact into a temporary directory."""
+
+    def setUp(self):
+        super(PublishedFilesMixin, self).setUp()
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.htaccess = os.path.join(self.workdir, '.htaccess')
+        self.settings = override_settings(HTACCESS_FILE=self.htaccess, HTACCESS_REBUILD_DELAY=0,
+            HTACCESS_REWRITE_MAP_FILE=os.path.join(self.workdir, 'vocab_redirects.txt'),
+            REDIRECT_ARTIFACT_FILE=os.path.join(self.workdir, 'vocab_redirects.bin'), CELERY_ALWAYS_EAGER=True)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.addCleanup(redirect_artifact.invalidate)
+        cache.clear()
+
+class ReviewTest(PublishedFilesMixin, TransactionTestCase):
+    def test_bulk_review(self):
+        owner = UserProfile.objects.create(user=User.objects.create_user('a', 'a@example.com', 'pw'))
+        silent = UserProfile.objects.create(user=User.objects.create_user('b', '', 'pw'))
+        pending = [RegisteredIRI.objects.create(vocabulary='adl', userprofile=owner),
+            RegisteredIRI.objects.create(vocabulary='adl', term_type='verbs', term='voided', userprofile=owner),
+            RegisteredIRI.objects.create(vocabulary='tincan', userprofile=silent)]
+        done = RegisteredIRI.objects.create(vocabulary='xapi', accepted=True, reviewed=True)
+
+        reviewed = review_iris([pending[0].id, pending[1].id, done.id], True, actor='root')
+        self.assertEqual(sorted(iri.id for iri in reviewed), [pending[0].id, pending[1].id])
+        # Only rows that are still pending once locked are reviewed, nothing twice
+        self.assertEqual(review_iris([pending[0].id], False), [])
+        self.assertEqual([iri.id for iri in review_iris([pending[2].id], False)], [pending[2].id])
+
+        self.assertEqual(sorted(RegisteredIRI.objects.values_list('vocabulary', 'term', 'accepted', 'reviewed')),
+            [('adl', '', True, True), ('adl', 'voided', True, True), ('tincan', '', False, True),
+            ('xapi', '', True, True)])
+        self.assertEqual(sorted(VocabularyCount.objects.values_list('vocabulary', 'term_type', 'total', 'accepted')),
+            [('adl', '', 1, 1), ('adl', 'verbs', 1, 1), ('tincan', '', 1, 0), ('xapi', '', 1, 1)])
+        self.assertEqual(sorted(RedirectDelta.objects.values_list('vocabulary', 'published')),
+            [('adl', True), ('adl', True), ('xapi', True)])
+        # One notice per reviewed IRI whose owner has an email address
+        notices = EmailNotice.objects.filter(subject=USER_NOTICE_SUBJECT).order_by('body')
+        self.assertEqual([(notice.recipient, notice.body.split('\n')[0]) for notice in notices],
+            [('a@example.com', 'Your IRI, https://w3id.org/xapi/adl, has been accepted.'),
+            ('a@example.com', 'Your IRI, https://w3id.org/xapi/adl/verbs/voided, has been accepted.')])
+        with open(self.htaccess) as htaccess:
+            self.assertIn('adl Vocabulary', htaccess.read())
+
+class HtaccessReceiverTest(PublishedFilesMixin, TransactionTestCase):
+
+    def published(self):
+        with open(self.htaccess) as htaccess:
+            return 'adl Vocabulary' in htaccess.read()
+
+    def test_single_iri_changes_rebuild(self):
+        iri = RegisteredIRI.objects.create(vocabulary='adl')
+        self.assertFalse(os.path.exists(self.htaccess))
+        # Reviewed outside adminIRIs, e.g. in the Django admin
+        iri = RegisteredIRI.objects.get(pk=iri.pk)
+        iri.accepted = iri.reviewed = True
+        iri.save()
+        self.assertTrue(self.published())
+        iri.accepted = False
+        iri.save()
+        self.assertFalse(self.published())
+        iri.accepted = True
+        iri.save()
+        iri.delete()
+        self.assertFalse(self.published())
+
+class ApiChangesTest(PublishedFilesMixin, TransactionTestCase):
+    def test_etag_changes_with_the_registry(self):
+        RegisteredIRI.objects.create(vocabulary='adl', term_type='verbs', term='voided', accepted=True, reviewed=True)
+        first = self.client.get('/api/v1/vocabularies/adl/terms')
+        self.assertEqual([row['term'] for row in json.loads(first.content)['terms']], ['voided'])
+        self.assertEqual(self.client.get('/api/v1/vocabularies/adl/terms', HTTP_IF_NONE_MATCH=first['ETag'])
+            .status_code, 304)
+        # Pending IRIs aren't listed, so they leave the ETag alone
+        iri = RegisteredIRI.objects.create(vocabulary='adl', term_type='verbs', term='answered')
+        self.assertEqual(self.client.get('/api/v1/vocabularies/adl/terms', HTTP_IF_NONE_MATCH=first['ETag'])
+            .status_code, 304)
+        # Accepted through the model, like the Django admin does
+        iri.accepted = iri.reviewed = True
+        iri.save()
+        changed = self.client.get('/api/v1/vocabularies/adl/terms', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+        self.assertEqual([row['term'] for row in json.loads(changed.content)['terms']], ['answered', 'voided'])
+        self.assertEqual(self.client.get('/api/v1/vocabularies/adl/terms', HTTP_IF_NONE_MATCH=changed['ETag'])
+            .status_code, 304)
+
+    def test_pages(self):
+        for term in ('a', 'b', 'c'):
+            RegisteredIRI.objects.create(vocabulary='adl', term_type='verbs', term=term, accepted=True, reviewed=True)
+        terms, url = [], '/api/v1/vocabularies/adl/verbs?limit=2'
+        while url:
+            page = json.loads(self.client.get(url).content)
+            terms.extend(row['term'] for row in page['terms'])
+            url = page['next']
+        self.assertEqual(terms, ['a', 'b', 'c'])
+
+class ArtifactReceiverTest(PublishedFilesMixin, TransactionTestCase):
+    def test_pending_iris_keep_the_artifact(self):
+        RegisteredIRI.objects.create(vocabulary='adl', accepted=True, reviewed=True)
+        version = RegistryVersion.current()
+        table = RoutingTable(refresh_interval=0)
+        self.assertIsNotNone(table.lookup('adl'))
+        self.assertIsNone(table._routes)
+
+        iri = RegisteredIRI.objects.create(vocabulary='adl', term_type='verbs', term='voided')
+        iri = RegisteredIRI.objects.get(pk=iri.pk)
+        iri.reviewed = True
+        iri.save()
+        iri.delete()
+        self.assertEqual(RegistryVersion.current(), version)
+        # Still answered by the artifact rather than a table of this process's own
+        self.assertIsNotNone(table.lookup('adl'))
+        self.assertIsNone(table.lookup('adl', 'verbs', 'voided'))
+        self.assertIsNone(table._routes)
+
+class RoutingTableTest(TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.settings = override_settings(REDIRECT_ARTIFACT_FILE=os.path.join(self.workdir, 'vocab_redirects.bin'))
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.addCleanup(redirect_artifact.invalidate)
+
+    def test_stale_artifact_is_not_used(self):
+        publish_redirect_artifact()
+        RegisteredIRI.objects.create(vocabulary='adl', accepted=True, reviewed=True)
+        RegistryVersion.bump()
+        redirect_artifact.invalidate()
+        table = RoutingTable(refresh_interval=0)
+        # The compile for the new IRI hasn't run, the table answers
+        self.assertIsNotNone(table.lookup('adl'))
+        self.assertEqual(len(table), 1)
+
+        publish_redirect_artifact()
+        redirect_artifact.invalidate()
+        self.assertIsNotNone(table.lookup('adl'))
+        self.assertIsNone(table._routes)
+
+class RateLimiterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_burst_per_window(self):
+        limiter = RateLimiter()
+        # 2 requests per 2 minute window
+        self.assertEqual([limiter.hit('test', 'a', '1/m', 2, now=1260.0) for _ in range(3)], [0, 0, 120.0])
+        self.assertEqual(limiter.hit('test', 'b', '1/m', 2, now=1260.0), 0)
+        # The next window still counts both, until half of it has passed
+        self.assertEqual(limiter.hit('test', 'a', '1/m', 2, now=1320.0), 60.0)
+        self.assertEqual(limiter.hit('test', 'a', '1/m', 2, now=1380.0), 0)
+
+    def test_no_second_burst_across_the_window_boundary(self):
+        limiter = RateLimiter()
+        self.assertEqual([limiter.hit('test', 'a', '1/m', 2, now=1319.0) for _ in range(2)], [0, 0])
+        # A fixed window would start over at 1320 and allow two more
+        wait = limiter.hit('test', 'a', '1/m', 2, now=1321.0)
+        self.assertEqual(wait, 59.0)
+        self.assertEqual(limiter.hit('test', 'a', '1/m', 2, now=1321.0 + wait), 0)
+        self.assertNotEqual(limiter.hit('test', 'a', '1/m', 2, now=1321.0 + wait), 0)
+
+    def test_parallel_requests_share_the_limit(self):
+        limiter = RateLimiter()
+        waits = []
+        threads = [threading.Thread(target=lambda: waits.append(limiter.hit('parallel', 'a', '1/h', 10)))
+            for _ in range(40)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(waits.count(0), 10)
+
+    @override_settings(RATELIMIT_IP_HEADER='HTTP_X_FORWARDED_FOR')
+    def test_client_is_the_address_our_proxy_appended(self):
+        request = RequestFactory().get('/', HTTP_X_FORWARDED_FOR='1.2.3.4, 10.0.0.7')
+        request.user = AnonymousUser()
+        self.assertEqual(client_id(request), 'ip-10.0.0.7')
+
+class RegisteredIRISaveTest(TestCase):
+    def test_save_existing(self):
+        iri = RegisteredIRI.objects.create(vocabulary='adl')
+        # Loaded again like the admin does, so post_init records the stored state
+        iri = RegisteredIRI.objects.get(pk=iri.pk)
+        iri.accepted = iri.reviewed = True
+        iri.save()
+        self.assertEqual(list(RedirectDelta.objects.values_list('vocabulary', 'published')), [('adl', True)])
+
+        # Saving without a review change records nothing new
+        iri = RegisteredIRI.objects.get(pk=iri.pk)
+        iri.save()
+        self.assertEqual(RedirectDelta.objects.count(), 1)
+
+class VocabularyCountTest(TransactionTestCase):
+    def test_adjusted_on_commit(self):
+        with transaction.atomic():
+            VocabularyCount.adjust('adl', 'verbs', 2, 1)
+            VocabularyCount.adjust('adl', 'verbs', 1, 0)
+            self.assertFalse(VocabularyCount.objects.exists())
+        count = VocabularyCount.objects.get(vocabulary='adl', term_type='verbs')
+        self.assertEqual((count.total, count.accepted), (3, 1))
+
+    def test_rolled_back(self):
+        try:
+            with transaction.atomic():
+                VocabularyCount.adjust('adl', 'verbs', 1, 1)
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertFalse(VocabularyCount.objects.exists())
+
+    def check_apply(self):
+        VocabularyCount.apply('adl', 'verbs', 1, 1)
+        VocabularyCount.apply('adl', 'verbs', 2, 0)
+        self.assertEqual(list(VocabularyCount.objects.values_list('total', 'accepted')), [(3, 1)])
+
+    def test_apply_upsert(self):
+        if not supports_on_conflict():
+            self.skipTest("INSERT ... ON CONFLICT needs Postgres 9.5+")
+        self.check_apply()
+
+    def test_apply_fallback(self):
+        without_on_conflict(self, models)
+        self.check_apply()
+
+class UserIRIsVersionTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = UserProfile.objects.create(user=User.objects.create_user('alice', 'alice@example.com', 'pw'))
+
+    def test_bumped_on_commit(self):
+        before = user_iris_version(self.profile.user_id)
+        with transaction.atomic():
+            RegisteredIRI.objects.create(vocabulary='adl', term_type='verbs', term='shared', userprofile=self.profile)
+            self.assertEqual(user_iris_version(self.profile.user_id), before)
+        self.assertNotEqual(user_iris_version(self.profile.user_id), before)
+
+    def test_rolled_back(self):
+        before = user_iris_version(self.profile.user_id)
+        try:
+            with transaction.atomic():
+                RegisteredIRI.objects.create(vocabulary='adl', term_type='verbs', term='shared', userprofile=self.profile)
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertEqual(user_iris_version(self.profile.user_id), before)
+
+    def test_loaded_profile_is_not_queried(self):
+        iri = RegisteredIRI.objects.create(vocabulary='adl', term_type='verbs', term='shared', userprofile=self.profile)
+        with CaptureQueriesContext(connection) as queries:
+            iri.accepted = iri.reviewed = True
+            iri.save()
+            iri.delete()
+        self.assertFalse([query for query in queries if 'vocab_userprofile' in query['sql']])
+
+class RedirectChangesTest(TestCase):
+    def test_unstamped_deltas_are_held_back(self):
+        RedirectDelta.record([('adl', 'verbs', 'x')], True)
+        # The recording transaction hasn't committed, so no version yet
+        self.assertEqual(redirect_changes(0)["deltas"], [])
+        RedirectDelta.stamp()
+        changes = redirect_changes(0)
+        self.assertEqual(changes["version"], RegistryVersion.current())
+        self.assertEqual([(delta["term"], delta["version"]) for delta in changes["deltas"]],
+            [('x', changes["version"])])
+
+    def test_first_snapshot_is_not_written_by_readers(self):
+        RegisteredIRI.objects.create(vocabulary='adl', accepted=True, reviewed=True)
+        RedirectDelta.stamp()
+        changes = redirect_changes()
+        self.assertEqual([route["vocabulary"] for route in changes["snapshot"]["routes"]], ['adl'])
+        self.assertFalse(RedirectSnapshot.objects.exists())
+
+    def test_compaction_stamps_leftover_deltas(self):
+        RegisteredIRI.objects.create(vocabulary='adl', accepted=True, reviewed=True)
+        snapshot = compact_redirects()
+        self.assertFalse(RedirectDelta.objects.filter(version=None).exists())
+        self.assertEqual((snapshot.version, snapshot.size), (RegistryVersion.current(), 1))
+        self.assertEqual(redirect_changes(snapshot.version)["deltas"], [])
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AuditLogTest(TestCase):
+    def test_days_is_clamped(self):
+        User.objects.create_superuser('root', 'root@example.com', 'pw')
+        client = Client()
+        client.login(username='root', password='pw')
+        self.assertEqual(client.get('/auditLog', {'days': 10 ** 12}).status_code, 200)
+
+class FailingBackend(BaseEmailBackend):
+    def send_messages(self, messages):
+        raise SMTPException("Connection refused")
+
+class UnreachableBackend(BaseEmailBackend):
+    def open(self):
+        raise socket.error("Connection timed out")
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class OutboxTest(TestCase):
+    def test_one_digest_per_recipient(self):
+        queue_notice(['a@example.com'], "First", "first body")
+        queue_notice(['a@example.com', 'b@example.com'], "Second", "second body")
+        self.assertEqual(drain_outbox(), 2)
+        self.assertEqual(sorted(message.to for message in mail.outbox), [['a@example.com'], ['b@example.com']])
+        digest = [message for message in mail.outbox if message.to == ['a@example.com']][0]
+        self.assertIn("first body", digest.body)
+        self.assertIn("second body", digest.body)
+        # Everything was marked sent, nothing goes out twice
+        self.assertEqual(drain_outbox(), 0)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_claimed_notices_are_skipped(self):
+        queue_notice(['a@example.com'], "First", "first body")
+        # Another drain, e.g. in a second worker, got to them first
+        self.assertEqual(len(claim_notices()), 1)
+        self.assertEqual(drain_outbox(), 0)
+        self.assertEqual(mail.outbox, [])
+
+    def test_failed_send_is_retried_later(self):
+        queue_notice(['a@example.com'], "First", "first body")
+        self.assertEqual(drain_outbox(FailingBackend()), 0)
+        notice = EmailNotice.objects.get()
+        self.assertEqual((notice.sent, notice.attempts), (None, 1))
+        self.assertGreater(notice.next_attempt, timezone.now())
+        self.assertIn("Connection refused", notice.last_error)
+
+    def test_unreachable_server_counts_as_an_attempt(self):
+        queue_notice(['a@example.com', 'b@example.com'], "First", "first body")
+        handler = RecordingHandler()
+        outbox_logger = logging.getLogger('vocab.outbox')
+        outbox_logger.addHandler(handler)
+        self.addCleanup(outbox_logger.removeHandler, handler)
+        with override_settings(OUTBOX_MAX_ATTEMPTS=2):
+            self.assertEqual(drain_outbox(UnreachableBackend()), 0)
+            self.assertEqual(list(EmailNotice.objects.values_list('attempts', flat=True)), [1, 1])
+            EmailNotice.objects.update(next_attempt=timezone.now())
+            self.assertEqual(drain_outbox(UnreachableBackend()), 0)
+            # Given up on, and logged
+            self.assertEqual(claim_notices(timezone.now() + timedelta(days=1)), [])
+        self.assertEqual(len([record for record in handler.records if 'gave up' in record.getMessage()]), 2)
@@ -0,0 +1,45 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, CharField, Count, IntegerField, Sum, Value, When
+from django.db.models.functions import Concat
+
+from .models import RegisteredIRI, VocabularyCount
+
+def adjust_counts(iris, total=0, accepted=0):
+    """Apply one VocabularyCount update per (vocabulary, term_type) in iris.
+
+    For the bulk paths (bulk_create, queryset.update) that skip the
+    RegisteredIRI receivers.
+    """
+    for (vocabulary, term_type), count in Counter((iri.vocabulary, iri.term_type) for iri in iris).items():
+        VocabularyCount.adjust(vocabulary, term_type, total * count, accepted * count)
+
+def vocabulary_counts(accepted_only=True):
+    """Queryset of (vocabulary, count) ordered by vocabulary, from the materialized counts."""
+    field = 'accepted' if accepted_only else 'total'
+    return VocabularyCount.objects.values_list('vocabulary').annotate(count=Sum(field)) \
+        .filter(count__gt=0).order_by('vocabulary')
+
+def address_expression():
+    """RegisteredIRI.build_address() as SQL, for set-based updates."""
+    def joined(field, rest):
+        return Case(When(**{field: '', 'then': Value('')}), default=Concat(Value('/'), field, *rest),
+            output_field=CharField())
+    return Concat(Value(settings.IRI_DOMAIN), 'vocabulary', joined('term_type', [joined('term', [])]),
+        output_field=CharField())
+
+@transaction.atomic
+def rebuild_vocabulary_tree():
+    """Recompute every denormalized address and VocabularyCount row from scratch."""
+    # One UPDATE for every stale address, rather than a round trip per row
+    address = address_expression()
+    stale = RegisteredIRI.objects.exclude(address=address).update(address=address)
+
+    counts = RegisteredIRI.objects.order_by().values_list('vocabulary', 'term_type').annotate(total=Count('id'),
+        accepted_total=Sum(Case(When(accepted=True, then=Value(1)), default=Value(0), output_field=IntegerField())))
+    VocabularyCount.objects.all().delete()
+    VocabularyCount.objects.bulk_create([VocabularyCount(vocabulary=vocabulary, term_type=term_type, total=total,
+        accepted=accepted) for vocabulary, term_type, total, accepted in counts])
+    return stale, len(counts)
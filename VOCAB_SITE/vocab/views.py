@@ -1,5 +1,8 @@
+import json
 import logging
+from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.auth import logout, login, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
@@ -10,73 +13,142 @@ from django.db import transaction, IntegrityError
 from django.db.models import Q
 
 from django.forms import formset_factory
-from django.http import HttpResponseRedirect, HttpResponseForbidden
+from django.http import HttpResponse, HttpResponseNotFound, HttpResponseRedirect, HttpResponseForbidden, JsonResponse, \
+    StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
 
 from django.views.decorators.csrf import csrf_protect
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition, require_http_methods
 
+from .api import accepted_iris, iri_json, page_params, paginated_response, registry_etag
+from .audit import AUDIT_MAX_DAYS, decision_times, recent_events, review_throughput
+from .autocomplete import autocomplete_index
+from .cache import cache_anonymous_page, iri_cache, user_iris_version
+from .export import CONTENT_TYPES as EXPORT_CONTENT_TYPES, export_registry
 from .forms import RegisterForm, RegisteredIRIForm, SearchForm, RequiredFormSet
-from .models import RegisteredIRI, UserProfile
-from .tasks import notify_user, update_htaccess
+from .metrics import metrics
+from .models import AUDIT_EVENT_CHOICES, RegisteredIRI, UserProfile, iri_address, iri_path
+from .ratelimit import rate_limited
+from .redirects import redirect_changes
+from .registration import parse_vocabulary_upload, register_iris
+from .resolver import routing_table, wants_html
+from .review import pending_iris, review_iris
+from .search import RESULTS_PER_PAGE, search_iris
+from .tree import vocabulary_counts
 
 logger = logging.getLogger(__name__)
 
 @require_http_methods(["GET"])
+@cache_anonymous_page
 def home(request):
     return render(request, 'home.html')
 
 @csrf_protect
 @login_required
 @require_http_methods(["GET", "POST"])
+@rate_limited('createIRI', methods=('POST',))
 @transaction.atomic
 def createIRI(request):
     RegisteredIRIFormset = formset_factory(RegisteredIRIForm, formset=RequiredFormSet)
     # if this is a POST request we need to process the form data
     if request.method == 'POST':
         # create a form instance and populate it with data from the request:
-        formset = RegisteredIRIFormset(request.POST)
+        # uniqueness is checked once for the whole formset below
+        formset = RegisteredIRIFormset(request.POST, form_kwargs={'check_unique': False})
         # check whether it's valid:
         if formset.is_valid():
-            # process the data in form.cleaned_data as required
-            for form in formset:
-                if form.is_valid():
-                    vocabulary = form.cleaned_data['vocabulary']
-                    termType = form.cleaned_data['term_type']
-                    term = form.cleaned_data['term']
-                    profile = UserProfile.objects.get(user=request.user)
-                    iriobj = RegisteredIRI.objects.create(vocabulary=vocabulary, term_type=termType, term=term, userprofile=profile)
-            return render(request, 'iriCreationResults.html', {'newiri': iriobj.return_address()})
+            triples = [(form.cleaned_data['vocabulary'], form.cleaned_data['term_type'], form.cleaned_data['term'])
+                for form in formset]
+            profile = UserProfile.objects.get(user=request.user)
+            created, conflicts = register_iris(profile, triples)
+            if created:
+                return render(request, 'iriCreationResults.html', {'newiris': [iri.return_address() for iri in created],
+                    'conflicts': [iri_address(*triple) for triple in conflicts]})
+            # Every IRI was already registered, show the form again
+            taken = set(conflicts)
+            for form, triple in zip(formset, triples):
+                if triple in taken:
+                    form.add_error(None, "This IRI has already been registered.")
     # if a GET (or any other method) we'll create a blank form
     else:
         formset = RegisteredIRIFormset()
     return render(request, 'createIRI.html', {'formset': formset})
 
+@csrf_protect
+@login_required
+@require_http_methods(["POST"])
+@rate_limited('createIRI')
+@transaction.atomic
+def createIRIUpload(request):
+    # Accepts a whole vocabulary as a JSON body or as an uploaded "file".
+    # Checked before the body or the multipart upload is read
+    try:
+        size = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        size = 0
+    if size > settings.VOCAB_UPLOAD_MAX_SIZE:
+        return JsonResponse({"errors": "Uploads are limited to %d bytes" % settings.VOCAB_UPLOAD_MAX_SIZE},
+            status=413)
+    try:
+        if 'file' in request.FILES:
+            data = json.load(request.FILES['file'])
+        else:
+            data = json.loads(request.body)
+    except ValueError as ve:
+        return JsonResponse({"errors": "Invalid JSON: %s" % ve.message}, status=400)
+
+    triples, errors = parse_vocabulary_upload(data)
+    if errors:
+        return JsonResponse({"errors": errors}, status=400)
+    if not triples:
+        return JsonResponse({"errors": "No IRIs were given"}, status=400)
+
+    profile = UserProfile.objects.get(user=request.user)
+    created, conflicts = register_iris(profile, triples)
+    return JsonResponse({"created": [iri.return_address() for iri in created],
+        "conflicts": [iri_address(*triple) for triple in conflicts]}, status=201 if created else 200)
+
+@login_required
+@require_http_methods(["GET"])
+def autocomplete(request):
+    # Answered from the in-memory index, see autocomplete.py
+    field = request.GET.get('field', 'vocabulary')
+    value = request.GET.get('q', '').strip()
+    if field not in ('vocabulary', 'term') or not value:
+        return JsonResponse({"error": "Give a field (vocabulary or term) and a q to complete"}, status=400)
+    return JsonResponse(autocomplete_index.complete(field, value, request.GET.get('vocabulary', ''),
+        request.GET.get('term_type', '')))
+
 @csrf_protect
 @require_http_methods(["POST", "GET"])
+@rate_limited('createUser', methods=('POST',))
 @transaction.atomic
 def createUser(request):
     if request.method == 'GET':
         form = RegisterForm()
         return render(request, 'createUser.html', {"form": form})
     elif request.method == 'POST':
-        import pdb
-        pdb.set_trace()
         form = RegisterForm(request.POST)
         if form.is_valid():
             name = form.cleaned_data['username']
             pword = form.cleaned_data['password']
             email = form.cleaned_data['email']
-            # If username doesn't already exist
-            if not User.objects.filter(username__exact=name).count():
-                # if email doesn't already exist
-                if not User.objects.filter(email__exact=email).count():
+            # One query for both the username and the email
+            existing = list(User.objects.filter(Q(username__exact=name) | Q(email__exact=email))
+                .values_list('username', flat=True)[:2])
+            if name in existing:
+                return render(request, 'createUser.html', {"form": form, "error_message": "User %s already exists." % name})
+            elif existing:
+                return render(request, 'createUser.html', {"form": form, "error_message": "Email %s is already registered." % email})
+            try:
+                # A concurrent signup can still take the username between the
+                # check and the insert; the unique constraint is the real check
+                with transaction.atomic():
                     user = User.objects.create_user(name, email, pword)
-                    UserProfile.objects.create(user=user)
-                else:
-                    return render(request, 'createUser.html', {"form": form, "error_message": "Email %s is already registered." % email})
-            else:
+            except IntegrityError:
                 return render(request, 'createUser.html', {"form": form, "error_message": "User %s already exists." % name})
+            UserProfile.objects.create(user=user)
             # If a user is already logged in, log them out
             if request.user.is_authenticated():
                 logout(request)
@@ -116,18 +188,25 @@ def createVocab(request):
 @login_required
 @require_http_methods(["GET"])
 def userProfile(request):
-    return render(request, 'userProfile.html')
+    # Only evaluated when the template's cached listing is stale
+    iris = RegisteredIRI.objects.filter(userprofile__user=request.user).order_by('address') \
+        .values('address', 'accepted', 'reviewed')
+    return render(request, 'userProfile.html', {"iris": iris, "iris_version": user_iris_version(request.user.id)})
 
 @csrf_protect
 @require_http_methods(["GET", "POST"])
+@rate_limited('searchResults')
+@cache_anonymous_page
 def searchResults(request):
-    if request.method == 'POST':
-        form = SearchForm(request.POST)
-        if form.is_valid:
-            query = Q(vocabulary__contains=form.data['search_term']) | Q(term_type__contains=form.data['search_term']) \
-                | Q(term__contains=form.data['search_term'])
-            iris = RegisteredIRI.objects.filter(query & Q(accepted=True))
-        return render(request, 'searchResults.html', {"form":form, "iris":iris})
+    # Searches are submitted as GET so el_pagination can carry the search
+    # term through its page links; POST is still accepted for old forms
+    data = request.POST if request.method == 'POST' else request.GET
+    if 'search_term' in data:
+        form = SearchForm(data)
+        if form.is_valid():
+            iris = search_iris(form.cleaned_data['search_term'])
+            return render(request, 'searchResults.html', {"form":form, "iris":iris,
+                "per_page": RESULTS_PER_PAGE})
     else:
         form = SearchForm()
     return render(request, 'searchResults.html', {"form":form})
@@ -138,29 +217,124 @@ def searchResults(request):
 @transaction.atomic
 def adminIRIs(request):
     if request.user.is_superuser:
-        iris = RegisteredIRI.objects.filter(accepted=False, reviewed=False)
         if request.method == "GET":
-            return render(request, 'adminIRIs.html', {"iris": iris})
-        else:
-            vocabulary = request.POST['hidden-vocabulary']
-            term_type = request.POST['hidden-term_type']
-            term = request.POST['hidden-term']
             try:
-                iri = RegisteredIRI.objects.get(vocabulary=vocabulary, term_type=term_type, term=term)
-            except RegisteredIRI.DoesNotExist as dne:
-                logger.exception(dne.message)
-            else:
-                if request.POST['action'] == "Accept":
-                    iri.accepted = True
-                    iri.reviewed = True
-                    update_htaccess.delay("fake title", iri.vocabulary, "http://jsonld-redirect", "http://html-redirect")
-                else:
-                    iri.reviewed = True
-                iri.save()
-                notify_user.delay(iri.return_address(), iri.userprofile.user.email, iri.accepted)
-        return render(request, 'adminIRIs.html', {"iris": iris})
+                after = int(request.GET.get('after', 0))
+            except ValueError:
+                after = 0
+            iris, has_more = pending_iris(after)
+            return render(request, 'adminIRIs.html', {"iris": iris, "has_more": has_more,
+                "next_after": iris[-1].id if iris else None})
+        else:
+            ids = [int(pk) for pk in request.POST.getlist('ids') if pk.isdigit()]
+            reviewed = review_iris(ids, request.POST.get('action') == "Accept", actor=request.user.username)
+            logger.info("%s %s %d IRIs" % (request.user.username, request.POST.get('action'), len(reviewed)))
+            url = reverse('adminIRIs')
+            if request.POST.get('after'):
+                url += '?after=%s' % request.POST['after']
+            return HttpResponseRedirect(url)
+    else:
+        return HttpResponseForbidden()
+
+@login_required()
+@require_http_methods(["GET"])
+def auditLog(request):
+    if not request.user.is_superuser:
+        return HttpResponseForbidden()
+    try:
+        days = min(max(1, int(request.GET.get('days', 30))), AUDIT_MAX_DAYS)
+        before = int(request.GET.get('before', 0))
+    except ValueError:
+        days, before = 30, 0
+    since = timezone.now() - timedelta(days=days)
+    filters = dict((name, request.GET.get(name, '')) for name in ('event', 'vocabulary', 'actor'))
+    events, has_more = recent_events(since, before=before, **filters)
+    next_page = request.GET.copy()
+    if events:
+        next_page['before'] = events[-1].id
+    decisions = decision_times(since)
+    # Shown in hours, reviews take days rather than seconds
+    hours = dict((name, decisions[name] / 3600.0 if decisions[name] is not None else None)
+        for name in ('mean', 'median', 'p90', 'max'))
+    return render(request, 'auditLog.html', {"events": events, "has_more": has_more,
+        "next_page": next_page.urlencode(), "throughput": review_throughput(since), "decisions": decisions['count'],
+        "hours": hours, "days": days, "filters": filters, "event_choices": AUDIT_EVENT_CHOICES})
+
+@require_http_methods(["GET", "HEAD"])
+def resolveIRI(request, vocabulary, term_type=None, term=None):
+    # Answers from the in-memory routing table, no database access
+    targets = routing_table.lookup(vocabulary, term_type, term)
+    if targets is None:
+        return HttpResponseNotFound()
+    json_redirect, html_redirect = targets
+    if wants_html(request.META.get('HTTP_ACCEPT', ''), request.META.get('HTTP_USER_AGENT', '')):
+        location = html_redirect
     else:
+        location = json_redirect
+    response = HttpResponse(status=303)
+    response['Location'] = location
+    response['Vary'] = 'Accept, User-Agent'
+    return response
+
+@require_http_methods(["GET", "HEAD"])
+@condition(etag_func=registry_etag)
+def apiVocabularies(request):
+    after, limit = page_params(request)
+    vocabularies = vocabulary_counts()
+    if after:
+        vocabularies = vocabularies.filter(vocabulary__gt=after)
+    rows = [{"vocabulary": vocabulary, "iri": settings.IRI_DOMAIN + vocabulary, "iris": count}
+        for vocabulary, count in vocabularies[:limit + 1]]
+    return paginated_response(request, "vocabularies", rows, lambda row: row["vocabulary"], limit)
+
+@require_http_methods(["GET", "HEAD"])
+@condition(etag_func=registry_etag)
+def apiTerms(request, vocabulary, term_type=None):
+    after, limit = page_params(request)
+    iris = accepted_iris().filter(vocabulary=vocabulary).exclude(term_type='')
+    if term_type:
+        iris = iris.filter(term_type=term_type)
+    iris = iris.order_by('term_type', 'term').values_list('vocabulary', 'term_type', 'term')
+    if after:
+        after_type, _, after_term = after.partition('/')
+        iris = iris.filter(Q(term_type__gt=after_type) | Q(term_type=after_type, term__gt=after_term))
+    rows = [iri_json(*triple) for triple in iris[:limit + 1]]
+    return paginated_response(request, "terms", rows, lambda row: "%s/%s" % (row["term_type"], row["term"]), limit)
+
+@require_http_methods(["GET", "HEAD"])
+@condition(etag_func=registry_etag)
+def apiIRI(request, vocabulary, term_type=None, term=None):
+    triple = (vocabulary, term_type or '', term or '')
+    # The "is it accepted" check every client makes, answered from iri_cache
+    # at the version the ETag was built from
+    if iri_cache.get_address(*triple, version=request.registry_version) is None:
+        return JsonResponse({"error": "No accepted IRI %s" % iri_path(*triple)}, status=404)
+    return JsonResponse(iri_json(*triple))
+
+@require_http_methods(["GET", "HEAD"])
+def apiRedirects(request):
+    # Resolver/Apache nodes poll with ?since=<the version they last applied>
+    try:
+        since = int(request.GET['since'])
+    except (KeyError, ValueError):
+        since = None
+    return JsonResponse(redirect_changes(since))
+
+@require_http_methods(["GET"])
+def exportIRIs(request, fmt):
+    use_gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    response = StreamingHttpResponse(export_registry(fmt, use_gzip), content_type=EXPORT_CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = 'attachment; filename="xapi-vocabulary.%s"' % fmt
+    response['Vary'] = 'Accept-Encoding'
+    if use_gzip:
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+@require_http_methods(["GET"])
+def metricsView(request):
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS and not request.user.is_superuser:
         return HttpResponseForbidden()
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4')
 
 @login_required()
 @require_http_methods(["GET"])
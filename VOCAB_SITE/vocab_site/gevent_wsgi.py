@@ -0,0 +1,31 @@
+"""
+Cooperative WSGI config for vocab_site project.
+
+Same ``application`` as wsgi.py, but with the standard library and psycopg2
+patched for gevent first, so a worker that is waiting on the database (or
+the cache, or the mail server) serves other requests in the meantime. Run
+it under gunicorn's gevent worker:
+
+    gunicorn vocab_site.gevent_wsgi -k gevent -w 4 --worker-connections 200
+
+The patching has to happen before anything else imports socket or
+psycopg2, so this module must be the entry point; don't import it from
+the rest of the project. Database connections are closed after each
+request here, whatever CONN_MAX_AGE says (see vocab/db.py).
+"""
+from gevent import monkey
+monkey.patch_all()
+
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "vocab_site.settings")
+
+from vocab.db import use_per_request_connections
+use_per_request_connections()
+
+application = get_wsgi_application()
@@ -0,0 +1,23 @@
+"""
+Settings for running the vocab tests.
+
+manage.py test picks this module up by itself; other runners need
+DJANGO_SETTINGS_MODULE=vocab_site.test_settings (or --settings).
+"""
+
+from .settings import *
+
+# Tasks run in the test process, with kombu's in-memory transport standing in
+# for RabbitMQ, and audit events are written on commit instead of by a thread
+BROKER_URL = 'memory://'
+CELERY_ALWAYS_EAGER = True
+CELERY_EAGER_PROPAGATES_EXCEPTIONS = True
+AUDIT_ASYNC = False
+
+# With the tasks in-process the test process can keep its own cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'vocab',
+    }
+}
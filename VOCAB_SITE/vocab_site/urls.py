@@ -25,10 +25,23 @@ urlpatterns = [
     url(r'^accounts/logout/$', views.logout_view, name="logout"),
     url(r'^$', views.home, name="home"),
     url(r'^adminIRIs$', views.adminIRIs, name="adminIRIs"),
+    url(r'^auditLog$', views.auditLog, name="auditLog"),
     url(r'^createIRI$', views.createIRI, name="createIRI"),
+    url(r'^createIRI/upload$', views.createIRIUpload, name="createIRIUpload"),
+    url(r'^autocomplete$', views.autocomplete, name="autocomplete"),
     url(r'^createUser$', views.createUser, name="createUser"),
     url(r'^createVocab$', views.createVocab, name="createVocab"),
     url(r'^searchResults$', views.searchResults, name="searchResults"),
     # url(r'^vocabReceived$', views.vocabReceived, name="vocabReceived"),
     url(r'^userProfile$', views.userProfile, name="userProfile"),
+    url(r'^api/v1/vocabularies$', views.apiVocabularies, name="apiVocabularies"),
+    url(r'^api/v1/vocabularies/(?P<vocabulary>[\w-]+)/terms$', views.apiTerms, name="apiTerms"),
+    url(r'^api/v1/vocabularies/(?P<vocabulary>[\w-]+)/(?P<term_type>[\w-]+)$', views.apiTerms, name="apiTermTypeTerms"),
+    url(r'^api/v1/iris/(?P<vocabulary>[\w-]+)(?:/(?P<term_type>[\w-]+))?(?:/(?P<term>[\w-]+))?$', views.apiIRI,
+        name="apiIRI"),
+    url(r'^api/v1/redirects$', views.apiRedirects, name="apiRedirects"),
+    url(r'^export\.(?P<fmt>jsonld|nt|csv)$', views.exportIRIs, name="exportIRIs"),
+    url(r'^metrics$', views.metricsView, name="metrics"),
+    url(r'^xapi/(?P<vocabulary>[\w-]+)(?:/(?P<term_type>[\w-]+))?(?:/(?P<term>[\w-]+))?/?$', views.resolveIRI,
+        name="resolveIRI"),
 ]
@@ -29,10 +29,17 @@ def setup_project():
     if not os.path.exists(supervisord_log_dir):
         os.makedirs(supervisord_log_dir)
 
+    htaccess_dir = os.path.join(cwd, '../htaccess')
+    if not os.path.exists(htaccess_dir):
+        os.makedirs(htaccess_dir)
+
     local('./VOCAB_SITE/manage.py makemigrations vocab')
     local('./VOCAB_SITE/manage.py migrate')
     local('./VOCAB_SITE/manage.py createsuperuser')
     local('./VOCAB_SITE/manage.py loaddata initial.json')
+    local('./VOCAB_SITE/manage.py rebuildvocabtree')
+    local('./VOCAB_SITE/manage.py compileredirects')
+    local('./VOCAB_SITE/manage.py buildstatic')
 
     # Add settings module so fab file can see it
     os.environ['DJANGO_SETTINGS_MODULE'] = "vocab_site.settings"
\ No newline at end of file